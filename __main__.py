@@ -5,9 +5,25 @@ import threading
 import time
 
 from solarlog_exporter import settings
-from solarlog_exporter.core import start_ftp_import
+from solarlog_exporter.core import SNAPSHOT, get_ftp_mdtm, start_export, start_ftp_import, start_import
+from solarlog_exporter.ftp_sync import FtpSession
+from solarlog_exporter.influx import InfluxConnection
+from solarlog_exporter.metrics import MetricsServer
+from solarlog_exporter.watch import AdaptivePoll, DirectoryWatcher
 
-def doImport():
+def createInfluxConnection():
+    if not settings.INFLUXDB_HOST or not settings.INFLUXDB_ORG or not settings.INFLUXDB_BUCKET:
+        raise Exception('INFLUX_HOST or INFLUX_ORG or INFLUX_BUCKET not defined!')
+
+    return InfluxConnection(
+        influx_host=settings.INFLUXDB_HOST,
+        influx_port=settings.INFLUXDB_PORT,
+        influx_org=settings.INFLUXDB_ORG,
+        influx_bucket=settings.INFLUXDB_BUCKET,
+        influx_token=settings.INFLUXDB_TOKEN
+    )
+
+def doImport(influx):
     """
     Run main application with can interface
     """
@@ -17,56 +33,92 @@ def doImport():
     else:
         logging.basicConfig(level=logging.INFO)
 
-    if not settings.INFLUXDB_HOST or not settings.INFLUXDB_ORG or not settings.INFLUXDB_BUCKET:
-        raise Exception('INFLUX_HOST or INFLUX_ORG or INFLUX_BUCKET not defined!')
-
     # scan directory
-    # if settings.DIRECTORY:
-    #     start_import(
-    #         settings.DIRECTORY,
-    #         influx_host=settings.INFLUXDB_HOST,
-    #         influx_port=settings.INFLUXDB_PORT,
-    #         influx_org=settings.INFLUXDB_ORG,
-    #         influx_bucket=settings.INFLUXDB_BUCKET,
-    #         influx_token=settings.INFLUXDB_TOKEN,
-    #     )
+    if settings.DIRECTORY:
+        start_import(settings.DIRECTORY, influx)
 
 
     # scan with ftp
     if settings.FTP_DIRECTORY:
-        start_ftp_import(
-            settings.FTP_DIRECTORY,
-            influx_host=settings.INFLUXDB_HOST,
-            influx_port=settings.INFLUXDB_PORT,
-            influx_org=settings.INFLUXDB_ORG,
-            influx_bucket=settings.INFLUXDB_BUCKET,
-            influx_token=settings.INFLUXDB_TOKEN
-        )
+        start_ftp_import(settings.FTP_DIRECTORY, influx)
 
     # raise Exception('One env variable of DIRECTORY or FTP_DIRECTORY must be defined!')
 
+def watchDirectory(killer):
+    """
+    Imports every file of DIRECTORY as soon as the Solar-Log changed it
+    """
+    watcher = DirectoryWatcher(settings.DIRECTORY)
+    watcher.start()
+    try:
+        # catch up with everything written while the exporter was not running
+        start_import(settings.DIRECTORY, killer.influx)
+        while not killer.kill_now:
+            changedFiles = watcher.wait(timeout=1)
+            if changedFiles:
+                logging.debug("Changed files: %s", changedFiles)
+                start_import(settings.DIRECTORY, killer.influx, changedFiles)
+    finally:
+        watcher.stop()
+
+def pollFtp(killer):
+    """
+    Imports from FTP whenever min_day.js changed, polling its modification time adaptively
+    """
+    poll = AdaptivePoll(settings.FTP_POLL_MIN_INTERVAL, settings.FTP_POLL_MAX_INTERVAL)
+    session = FtpSession(settings.FTP_HOST, settings.FTP_USERNAME, settings.FTP_PASSWORD)
+    try:
+        while not killer.kill_now:
+            if poll.changed(get_ftp_mdtm(session, settings.FTP_DIRECTORY, "min_day.js")):
+                # the import opens its own sessions, the Solar-Log only accepts a few at once
+                session.close()
+                start_ftp_import(settings.FTP_DIRECTORY, killer.influx)
+            logging.debug("Next poll in %.0f s", poll.interval)
+            e.wait(timeout=poll.interval)
+    finally:
+        session.close()
+
 e = threading.Event()
 
 class GracefulKiller:
   kill_now = False
-  def __init__(self):
+  def __init__(self, influx, metrics=None):
+    self.influx = influx
+    self.metrics = metrics
     signal.signal(signal.SIGINT, self.exit_gracefully)
     signal.signal(signal.SIGTERM, self.exit_gracefully)
 
   def exit_gracefully(self,signum, frame):
     self.kill_now = True
     e.set()
+
+  def shutdown(self):
+    if self.metrics is not None:
+      self.metrics.close()
+    self.influx.close()
     
 
 if __name__ == '__main__':
   logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
-  killer = GracefulKiller()
-  while True:
-    if killer.kill_now:
-      break
-    doImport()
-    e.wait(timeout=600)
-    if killer.kill_now:
-      break
+  if settings.PARQUET_EXPORT_DIRECTORY:
+    # one time export of the local history, influxdb is not needed
+    start_export(settings.DIRECTORY, settings.PARQUET_EXPORT_DIRECTORY)
+    sys.exit(0)
+  metrics = None
+  if SNAPSHOT is not None:
+    # scrapes are answered from the snapshot, they never reach the solar-log or influxdb
+    metrics = MetricsServer(SNAPSHOT, settings.METRICS_HOST, settings.METRICS_PORT)
+    metrics.start()
+  killer = GracefulKiller(createInfluxConnection(), metrics)
+  try:
+    if settings.DIRECTORY and settings.DIRECTORY_MONITOR_FOR_CHANGES:
+      watchDirectory(killer)
+    elif settings.FTP_DIRECTORY and settings.FTP_MONITOR_FOR_CHANGES:
+      pollFtp(killer)
+    while not killer.kill_now:
+      doImport(killer.influx)
+      e.wait(timeout=600)
+  finally:
+    killer.shutdown()
 
   logging.info("End of the program. I was killed gracefully :)")
@@ -0,0 +1,36 @@
+"""
+Compares the fast base_vars.js reader with the pyjsparser based reader.
+
+Run from the project directory: python -m benchmarks.config_parser
+"""
+import timeit
+from pathlib import Path
+
+from solarlog_exporter.parser import ConfigParser
+
+BASE_VARS = str(Path(__file__).parent.parent / "tests" / "assets" / "base_vars.js")
+RUNS = 20
+
+
+class PyjsparserConfigParser(ConfigParser):
+    def _parse_line(self, line):
+        self._parse_line_with_pyjsparser(line)
+
+
+def parse(parser_class):
+    config_parser = parser_class()
+    config_parser.parse_file(BASE_VARS)
+    return config_parser
+
+
+def main():
+    if parse(ConfigParser)._config != parse(PyjsparserConfigParser)._config:
+        raise SystemExit("Readers differ!")
+
+    for name, parser_class in (("fast reader", ConfigParser), ("pyjsparser", PyjsparserConfigParser)):
+        seconds = min(timeit.repeat(lambda: parse(parser_class), number=RUNS, repeat=3)) / RUNS
+        print(f"{name:12} {seconds * 1000:8.2f} ms per base_vars.js")
+
+
+if __name__ == "__main__":
+    main()
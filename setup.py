@@ -5,4 +5,6 @@ setuptools.setup(name='solarlog_exporter',  # Change to your package name
                  version='2.0.0',
                  author='Christoph Herb',
                  url='https://github.com/chrishrb/solarlog-exporter',
-                 packages=setuptools.find_packages(exclude=('tests', 'docs')))
+                 packages=setuptools.find_packages(exclude=('tests', 'docs')),
+                 # the parquet export (PARQUET_EXPORT_DIRECTORY), pyarrow has no wheels for all image platforms
+                 extras_require={'parquet': ['pyarrow>=14.0.1,<18']})
@@ -0,0 +1,61 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from solarlog_exporter.parser import ColumnarDataParser
+
+# set once per worker process by _init_worker
+_inverters = None
+_last_record_time = None
+_encode = None
+
+
+def _init_worker(inverters, last_record_time, encode):
+    global _inverters, _last_record_time, _encode
+    _inverters = inverters
+    _last_record_time = last_record_time
+    _encode = encode
+
+
+def parse_file(file_path):
+    """
+    Parses one file in a worker process into columns and returns (encoded points, RecordCutoff)
+    """
+    data_parser = ColumnarDataParser(_inverters, _last_record_time)
+    data_parser.parse_file(file_path)
+    return list(_encode(data_parser.drain_batches())), data_parser.cutoff
+
+
+def get_processes(processes):
+    """
+    Number of worker processes, 0 means one per core
+    """
+    return processes if processes > 0 else (os.cpu_count() or 1)
+
+
+def parse_files(file_paths, inverters, last_record_time, processes, encode):
+    """
+    Parses the files on a pool of processes and yields (file path, encoded points, cutoff) in the
+    order of file_paths. The columns are encoded in the workers with encode (Sink.encode_batches of the sink).
+    At most twice the number of processes of files are parsed ahead of the consumer, so a slow
+    sink slows the workers down instead of filling the memory.
+    """
+    window = processes * 2
+    logging.debug("Backfill of %s files with %s processes", len(file_paths), processes)
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(inverters, last_record_time, encode)) as executor:
+        pending = deque()
+        file_paths = iter(file_paths)
+        for file_path in file_paths:
+            pending.append((file_path, executor.submit(parse_file, file_path)))
+            if len(pending) >= window:
+                break
+        while pending:
+            file_path, future = pending.popleft()
+            encoded, cutoff = future.result()
+            next_path = next(file_paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(parse_file, next_path)))
+            yield file_path, encoded, cutoff
@@ -1,99 +1,148 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import os
-from ftplib import FTP, error_perm
+from ftplib import all_errors, error_perm
 import socket
 from time import sleep
 from typing import Set
 import time
 
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+from solarlog_exporter import settings
+from solarlog_exporter.backfill import get_processes, parse_files
+from solarlog_exporter.file_handler import (DEFAULT_LAST_RECORD_TIME, HighWaterMark, get_last_record_time,
+                                            is_import_day_file, is_import_min_file)
+from solarlog_exporter.ftp_sync import (FtpConnectionPool, FtpStateIndex, connect, fetch_in_order, fetch_new_data,
+                                        get_remote_stat, list_remote_files)
+from solarlog_exporter.influx import BatchWriter
+from solarlog_exporter.instrumentation import (DATAPOINTS, FTP_REQUEST_SECONDS, LINES, count_batches, count_points,
+                                               cycle_summary, sample)
+from solarlog_exporter.parser import ColumnarDataParser, ConfigCache, DataParser
+from solarlog_exporter.metrics import SnapshotSink
+from solarlog_exporter.sinks import InfluxSink, ObservedSink, ParquetSink
+from solarlog_exporter.spool import Spool
+from solarlog_exporter.utils import FileType, InverterList
 
-from solarlog_exporter import file_handler, settings
-from solarlog_exporter.file_handler import (get_last_record_time_influxdb, is_import_day_file, is_import_min_file)
-from solarlog_exporter.parser import ConfigParser, DataParser
+# imported files are remembered in the FTP state after this many files
+STATE_SAVE_INTERVAL = 50
+CONFIG_CACHE = ConfigCache(settings.CONFIG_CACHE_FILE if settings.CONFIG_CACHE_ON_DISK else None)
+SPOOL = Spool(settings.INFLUXDB_SPOOL_DIRECTORY, settings.INFLUXDB_SPOOL_SEGMENT_SIZE) \
+    if settings.INFLUXDB_SPOOL else None
+HIGH_WATER_MARK = HighWaterMark(settings.HIGH_WATER_MARK_FILE, settings.INFLUXDB_BUCKET) \
+    if settings.HIGH_WATER_MARK else None
+# latest values per inverter for the metrics endpoint, fed by every import
+SNAPSHOT = SnapshotSink() if settings.METRICS_PORT else None
 
-CHUNK_SIZE = 10000
 
-
-def start_import(
-    path,
-    influx_host,
-    influx_port,
-    influx_org,
-    influx_bucket,
-    influx_token
-):
-    client = InfluxDBClient(
-        url=influx_host+":"+influx_port,
-        token=influx_token,
-        org=influx_org)
-
-    query_api = client.query_api()
-
-    inverters = None
-    last_record_time = get_last_record_time_influxdb(query_api, influx_bucket)
-    client.close()
+def start_import(path, influx, changedFiles=None):
+    """
+    Imports the min and day files of a local directory, only changedFiles if given (watch mode)
+    """
+    cycleStart = sample()
+    last_record_time = get_last_record_time(influx.query_api(), influx.bucket, HIGH_WATER_MARK)
     logging.debug("Starting..")
     logging.debug("Used directory: %s", path)
     logging.debug("Last Record %s", last_record_time)
 
+    inverters = readInverters(path)
+    files = getImportFiles(path, last_record_time, changedFiles)
+
+    sink = createSink(influx)
+    try:
+        skippedLines, newestTime = importFiles(path, files, inverters, last_record_time, sink)
+    finally:
+        sink.close()
+    saveHighWaterMark(newestTime)
+
+    logging.debug("Daily and monthly data read..")
+    logging.info("%s lines not newer than the last record skipped", skippedLines)
+    logging.info("Import summary: %s", cycle_summary(cycleStart))
+
+
+def start_export(path, directory):
+    """
+    Exports the whole history of a local directory to parquet files, partitioned per day.
+    The partitions written are replaced, so an export can run again.
+    """
+    if not path:
+        raise Exception("DIRECTORY not defined!")
+    logging.debug("Export of %s to %s", path, directory)
+
+    # fails before anything is read if pyarrow is not installed
+    sink = ParquetSink(directory, overwrite=True)
+    inverters = readInverters(path)
+    files = getImportFiles(path, DEFAULT_LAST_RECORD_TIME)
+    try:
+        importFiles(path, files, inverters, DEFAULT_LAST_RECORD_TIME, sink)
+    finally:
+        sink.close()
+    logging.info("%s files exported to %s", len(files), directory)
+
+
+def readInverters(path):
     # Read Configs at start
     if os.path.exists(path + "/base_vars.js"):
-        config_parser = ConfigParser()
-        config_parser.parse_file(path + "/base_vars.js")
+        config_parser = CONFIG_CACHE.get_file(path + "/base_vars.js")
         inverters = config_parser.get_inverters()
         logging.debug("Inverters read from config..")
-    else:
-        raise Exception("No inverters in config found!")
+        return inverters
+    raise Exception("No inverters in config found!")
+
+
+def getImportFiles(path, last_record_time, changedFiles=None):
+    files = sorted(file for file in os.listdir(path) if is_import_min_file(file, last_record_time))
+    files += [file for file in os.listdir(path) if is_import_day_file(file, last_record_time)]
+    if changedFiles is not None:
+        files = [file for file in files if file in changedFiles]
+    return files
 
-    # Read Daily and Monthly Data
-    data_parser = DataParser(inverters, last_record_time)
-    for file in os.listdir(path):
-        if is_import_min_file(file, last_record_time):
+
+def importFiles(path, files, inverters, last_record_time, sink):
+    """
+    Reads Daily and Monthly Data, every file is written to the sink before the next one is read.
+    Returns (skipped lines, time of the newest minute record).
+    """
+    processes = get_processes(settings.BACKFILL_PROCESSES)
+    if processes > 1 and len(files) >= max(2, settings.BACKFILL_MIN_FILES):
+        # backfill: the files are parsed on a process pool and written in file order,
+        # the usual incremental import of a few new files does not pay for starting the pool
+        skippedLines = 0
+        newestTime = None
+        newestFile = None
+        for file, encoded, cutoff in parse_files([path + "/" + file for file in files], inverters,
+                                                 last_record_time, processes, sink.encode_batches):
             logging.debug("Read file %s", file)
-            data_parser.parse_file(path + "/" + file)
+            sink.write_encoded(encoded)
+            # the points were built in the worker, one encoded item per point
+            DATAPOINTS.inc(len(encoded))
+            countLines(cutoff)
+            skippedLines += cutoff.skipped
+            fileNewestTime = cutoff.get_newest_time()
+            if fileNewestTime is not None and (newestTime is None or fileNewestTime > newestTime):
+                newestTime, newestFile = fileNewestTime, file
+        if newestFile is not None:
+            showNewestRow(sink, newestFile, inverters, newestTime)
+        return skippedLines, newestTime
 
-    logging.debug("Daily and monthly data read..")
+    data_parser = get_data_parser(inverters, last_record_time)
+    try:
+        for file in files:
+            logging.debug("Read file %s", file)
+            data_parser.parse_file(path + "/" + file)
+            writeDataToSink(data_parser, sink)
+    finally:
+        countLines(data_parser.cutoff)
+    return data_parser.cutoff.skipped, data_parser.cutoff.get_newest_time()
 
-    # Store it in Influx DB
-    datapoints = file_handler.chunks(
-        inverters.get_inverter_datapoints_to_influx(), CHUNK_SIZE
-    )
-    client = InfluxDBClient(
-        url=influx_host+":"+influx_port,
-        token=influx_token,
-        org=influx_org)
-    write_api = client.write_api(write_options=SYNCHRONOUS)
-    for chunk in datapoints:
-        write_api.write(org=influx_org, bucket=influx_bucket, record=chunk)
-        logging.debug("Datapoints in influxdb saved")
-    write_api.close()
-
-
-def start_ftp_import(
-    path,
-    influx_host,
-    influx_port,
-    influx_org,
-    influx_bucket,
-    influx_token
-):
-    client = InfluxDBClient(
-        url=influx_host+":"+influx_port,
-        token=influx_token,
-        org=influx_org)
-
-    query_api = client.query_api()
 
+def start_ftp_import(path, influx):
+    cycleStart = sample()
     inverters = None
 
     # Retry mechanism for getting last_record_time
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            last_record_time = get_last_record_time_influxdb(query_api, influx_bucket)
+            last_record_time = get_last_record_time(influx.query_api(), influx.bucket, HIGH_WATER_MARK)
             break  # Success
         except Exception as e:
             logging.error(f"Attempt {attempt + 1} to get last_record_time failed: {e}")
@@ -102,10 +151,8 @@ def start_ftp_import(
                 time.sleep(60)
             else:
                 logging.error("All retries to get last_record_time failed.")
-                client.close()
                 raise
 
-    client.close()
     logging.debug("Starting..")
     logging.debug("Used directory: %s", path)
     logging.debug("Last Record %s", last_record_time)
@@ -114,35 +161,93 @@ def start_ftp_import(
         raise Exception("FTP_HOST not defined!")
 
     inverters = None
+    data_parser = None
+    sink = createSink(influx)
     try:
-        with FTP(settings.FTP_HOST) as ftp:
-            ftp.login(user=settings.FTP_USERNAME or "", passwd=settings.FTP_PASSWORD or "")
-            ftp.sendcmd('OPTS UTF8 ON')
+        with connect(settings.FTP_HOST, settings.FTP_USERNAME, settings.FTP_PASSWORD) as ftp:
+
+            state_index = FtpStateIndex(settings.FTP_STATE_FILE) if settings.FTP_INCREMENTAL_SYNC else None
+            if state_index and last_record_time <= DEFAULT_LAST_RECORD_TIME:
+                # empty database, import everything again
+                state_index.clear()
+            remoteFiles = list_remote_files(ftp, path)
 
-            # Read Configs at start
-            config_parser = ConfigParser()
-            config_parser.parse_ftp_file(ftp, path + "/base_vars.js")
+            # Read Configs at start, only downloaded and parsed again if the Solar-Log changed it
+            configStat = remoteFiles.get("base_vars.js") if remoteFiles is not None \
+                else get_remote_stat(ftp, path + "/base_vars.js")
+            config_parser = CONFIG_CACHE.get_ftp_file(ftp, path + "/base_vars.js", configStat)
 
             inverters, data_parser = createInvertersAndDataParsee(config_parser, last_record_time)
 
-            importFileCounter = 0
             fileCounter = 0
-            fileList = ftp.nlst(path)
+            if remoteFiles is not None:
+                fileList = list(remoteFiles.keys())
+            else:
+                with FTP_REQUEST_SECONDS.time(command="NLST"):
+                    fileList = ftp.nlst(path)
             filteredMinFileList = list(filter(lambda filename: is_import_min_file(filename, last_record_time), fileList))
             filteredMinFileList.sort()
             filteredDayFileList = list(filter(lambda filename: is_import_day_file(filename, last_record_time), fileList))
             allFiles = filteredMinFileList + filteredDayFileList
+            fetchJobs = []
             for file in allFiles:
                 fileCounter += 1
                 fileName = os.path.basename(file)
-                logging.debug(f"Read file {fileName}. {fileCounter}/{len(fileList)}")
-                data_parser.parse_ftp_file(ftp, path + "/" + fileName)
-                importFileCounter += 1
-                if importFileCounter >= 50:
-                    writeDataToinfluxDb(inverters, influx_host, influx_port, influx_org, influx_bucket, influx_token)
-                    importFileCounter = 0
-                    inverters, data_parser = createInvertersAndDataParsee(config_parser, last_record_time)
-            writeDataToinfluxDb(inverters, influx_host, influx_port, influx_org, influx_bucket, influx_token)
+                remoteStat = None
+                if state_index:
+                    remoteStat = remoteFiles.get(fileName) if remoteFiles is not None \
+                        else get_remote_stat(ftp, path + "/" + fileName)
+                    if state_index.is_unchanged(fileName, remoteStat):
+                        logging.debug(f"Skip unchanged file {fileName}. {fileCounter}/{len(fileList)}")
+                        continue
+                fetchJobs.append((fileName, remoteStat))
+
+            def fetchFile(connection, job, fileParser):
+                # lines are parsed while they arrive from the socket
+                fileName, remoteStat = job
+                entry = state_index.get(fileName) if state_index else None
+                stream = fileParser.line_stream(connection.encoding)
+                try:
+                    _, fileState = fetch_new_data(connection, path + "/" + fileName, entry, remoteStat, callback=stream)
+                except error_perm:
+                    logging.error("File is not under path %s", path + "/" + fileName)
+                    return None
+                stream.close()
+                return fileParser, fileState
+
+            inverterConfig, systemName = config_parser.get_inverter_config(), config_parser.get_title()
+
+            def fetchFileWithOwnParser(connection, job):
+                # runs in the fetch threads, every file gets a parser with inverters of its own
+                fileParser = get_data_parser(InverterList(inverterConfig, systemName), last_record_time)
+                return fetchFile(connection, job, fileParser)
+
+            importedFiles = []
+            with FtpConnectionPool(settings.FTP_HOST, settings.FTP_USERNAME, settings.FTP_PASSWORD,
+                                   settings.FTP_CONNECTIONS, connections=[ftp]) as pool:
+                if pool.size > 1:
+                    # files are downloaded and parsed in parallel but written in list order
+                    results = fetch_in_order(pool, fetchJobs, fetchFileWithOwnParser)
+                else:
+                    results = ((job, fetchFile(ftp, job, data_parser)) for job in fetchJobs)
+                for fileCounter, (job, result) in enumerate(results, 1):
+                    fileName, remoteStat = job
+                    if result is None:
+                        continue
+                    logging.debug(f"Read file {fileName}. {fileCounter}/{len(fetchJobs)}")
+                    fileParser, fileState = result
+                    # the datapoints of a file are written right away, memory does not grow with the file count
+                    writeDataToSink(fileParser, sink)
+                    if fileParser is not data_parser:
+                        data_parser.cutoff.merge(fileParser.cutoff)
+                    importedFiles.append((fileName, remoteStat, fileState))
+                    if len(importedFiles) >= STATE_SAVE_INTERVAL:
+                        saveFtpState(state_index, importedFiles, sink)
+                        importedFiles = []
+            saveFtpState(state_index, importedFiles, sink)
+            sink.flush()
+            saveHighWaterMark(data_parser.cutoff.get_newest_time())
+            logging.info("%s lines not newer than the last record skipped", data_parser.cutoff.skipped)
     except socket.error as e:
         if e.errno == 111:
             print("Connection refused. The FTP server may not be running.")
@@ -155,34 +260,88 @@ def start_ftp_import(
     except EOFError:
         print("EOFError: The connection was closed unexpectedly.")
         pass
+    finally:
+        # waits until all queued datapoints are written
+        sink.close()
+        # lines of a failed cycle are counted as well
+        if data_parser is not None:
+            countLines(data_parser.cutoff)
+    logging.info("Import summary: %s", cycle_summary(cycleStart))
+
+def get_ftp_mdtm(session, path, fileName):
+    """
+    Modification time of a single file on the FTP server, None if it can not be read.
+    The connection of the FtpSession is kept for the next poll.
+    """
+    try:
+        remoteStat = session.run(lambda ftp: get_remote_stat(ftp, path + "/" + fileName))
+    except all_errors as e:
+        logging.warning("Modification time of %s not readable: %s", fileName, e)
+        return None
+    return remoteStat[1] if remoteStat else None
+
+def saveHighWaterMark(newestTime):
+    """
+    Remembers the newest imported minute record, call it only after the sink is flushed
+    """
+    if HIGH_WATER_MARK is not None and newestTime is not None:
+        HIGH_WATER_MARK.update(newestTime)
+        logging.debug("High-water mark %s", newestTime)
+
+def showNewestRow(sink, filePath, inverters, newestTime):
+    """
+    Shows the newest minute row of a backfill to the observers of the sink (the metrics snapshot),
+    the workers only return encoded data
+    """
+    if not isinstance(sink, ObservedSink):
+        return
+    data_parser = get_data_parser(inverters, newestTime - timedelta(seconds=1))
+    data_parser.parse_file(filePath)
+    sink.show(data_parser.drain_points())
+
+def countLines(cutoff):
+    """
+    Adds the record lines read and skipped by a cutoff to the instruments
+    """
+    for fileType, name in ((FileType.MIN, "min"), (FileType.DAY, "day")):
+        skipped = cutoff.skipped_lines[fileType]
+        LINES.inc(cutoff.lines[fileType] - skipped, file_type=name, result="new")
+        LINES.inc(skipped, file_type=name, result="skipped")
+
+def saveFtpState(state_index, importedFiles, sink):
+    """
+    Remembers the imported files, but only after their datapoints are stored in influxdb
+    """
+    if not state_index or not importedFiles:
+        return
+    sink.flush()
+    for fileName, remoteStat, fileState in importedFiles:
+        state_index.update(fileName, remoteStat, **fileState)
+    state_index.save()
 
 def createInvertersAndDataParsee(config_parser, last_record_time):
     inverters = config_parser.get_inverters()
     if not inverters:
         raise Exception("No inverters in config found!")
     logging.debug("Inverters read from config..")
-    data_parser = DataParser(inverters, last_record_time)
+    data_parser = get_data_parser(inverters, last_record_time)
     return inverters, data_parser
 
-def writeDataToinfluxDb(
-        inverters,
-        influx_host,
-        influx_port,
-        influx_org,
-        influx_bucket,
-        influx_token):
-    # Store it in Influx DB
-    datapoints = file_handler.chunks(
-        inverters.get_inverter_datapoints_to_influx(), CHUNK_SIZE
-    )
-    client = InfluxDBClient(
-        url=influx_host+":"+influx_port,
-        token=influx_token,
-        org=influx_org)
-    write_api = client.write_api(write_options=SYNCHRONOUS)
-    influxCount = 0
-    for chunk in datapoints:
-        write_api.write(org=influx_org, bucket=influx_bucket, record=chunk)
-        logging.debug("Datapoints in influxdb saved: %s", influxCount)
-        influxCount += 1
-    write_api.close()
\ No newline at end of file
+def get_data_parser(inverters, last_record_time):
+    if settings.COLUMNAR_PARSING:
+        return ColumnarDataParser(inverters, last_record_time)
+    return DataParser(inverters, last_record_time)
+
+def createSink(influx):
+    sink = InfluxSink(BatchWriter(influx, spool=SPOOL))
+    if SNAPSHOT is not None:
+        return ObservedSink(sink, SNAPSHOT)
+    return sink
+
+def writeDataToSink(data_parser, sink):
+    # the points are drained lazily, nothing is collected in between
+    if isinstance(data_parser, ColumnarDataParser):
+        # whole columns, no point is built per sample
+        sink.write_batches(count_batches(data_parser.drain_batches()))
+    else:
+        sink.write(count_points(data_parser.drain_points()))
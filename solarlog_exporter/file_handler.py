@@ -1,6 +1,9 @@
+import json
 import logging
+import os
 import re
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 
 import pytz
 
@@ -8,6 +11,7 @@ from solarlog_exporter import settings
 from solarlog_exporter.utils import MinDatapoint
 
 _timezone = pytz.timezone(settings.TIMEZONE)
+DEFAULT_LAST_RECORD_TIME = datetime(2000, 1, 1).replace(tzinfo=_timezone)
 
 def is_import_min_file(filename, last_record_time):
     pattern = r'min\d{6}\.js'
@@ -32,32 +36,116 @@ def is_import_day_file(filename, last_record_time):
     return False
 
 
-def get_last_record_time_influxdb(query_api, influx_bucket):
-    # query = "SELECT * FROM {} WHERE system = '{}' ORDER BY time DESC LIMIT 1;".format(
-    #     MinDatapoint.influx_measurment_name, settings.SOLAR_LOG_NAME
-    # )
+# ranges searched for the last record, widened until a record is found
+LAST_RECORD_WINDOWS = ("-1d", "-7d", "-31d", "-366d", "0")
+
+
+def query_last_record_time(query_api, influx_bucket, start):
+    """
+    Time of the last record from start (a flux duration or time) on, None if there is none
+    """
     query = f'''
             from(bucket: "{influx_bucket}")
-              |> range(start: 0)
+              |> range(start: {start})
               |> filter(fn: (r) => r._measurement == "{MinDatapoint.influx_measurment_name}" and r.system == "{settings.SOLAR_LOG_NAME}")
-              |> sort(columns: ["_time"], desc: true)
-              |> limit(n: 1)
+              |> filter(fn: (r) => r._field == "Pac")
+              |> last()
             '''
 
-    result_last_point_query = list(query_api.query(query))
+    # one table per inverter, the newest of their last records counts
+    times = [record.values["_time"] for table in query_api.query(query) for record in table.records]
+    return max(times) if times else None
 
-    if result_last_point_query:
-        time = result_last_point_query[0].records[0].values["_time"]
-        logging.debug("Last record %s", time)
-        return time
+
+def get_last_record_time_influxdb(query_api, influx_bucket):
+    for window in LAST_RECORD_WINDOWS:
+        time = query_last_record_time(query_api, influx_bucket, window)
+        if time is not None:
+            logging.debug("Last record %s (range start %s)", time, window)
+            return time
 
     # no last record found
     logging.warning("No last record found")
-    defaultDate = datetime(2000, 1,1)
-    defaultDate = defaultDate.replace(tzinfo=_timezone)
-    return defaultDate
+    return DEFAULT_LAST_RECORD_TIME
+
+
+def get_last_record_time(query_api, influx_bucket, high_water_mark=None):
+    """
+    Time of the last imported record, from the local high-water mark if there is one.
+    The mark is checked once per process with a last record query bounded to the day before it.
+    Without a record there (the bucket was emptied or recreated) it is dropped and the last
+    record is searched in influxdb as if there was no mark.
+    """
+    if high_water_mark is not None:
+        time = high_water_mark.get()
+        if time is not None and not high_water_mark.checked:
+            start = (time - timedelta(days=1)).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            high_water_mark.checked = query_last_record_time(query_api, influx_bucket, start) is not None
+            if not high_water_mark.checked:
+                logging.warning("No record in influxdb around the high-water mark %s, dropping it", time)
+                high_water_mark.clear()
+                time = None
+        if time is not None:
+            logging.debug("Last record %s (high-water mark)", time)
+            return time
+    return get_last_record_time_influxdb(query_api, influx_bucket)
+
+
+class HighWaterMark:
+    """
+    Persisted time of the newest minute record written to InfluxDB, per bucket and system.
+    In steady state it replaces the last record query, which is only needed when it is missing.
+    checked is set once get_last_record_time() found the mark to match InfluxDB.
+    """
+
+    def __init__(self, file_path, influx_bucket=None, system=settings.SOLAR_LOG_NAME):
+        self._file_path = file_path
+        self._key = f"{influx_bucket}/{system}"
+        self._marks = {}
+        self.checked = False
+        if os.path.isfile(file_path):
+            try:
+                with open(file_path, "r", encoding="utf-8") as file:
+                    self._marks = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning("High-water mark %s not readable, ignoring it: %s", file_path, e)
+
+    def get(self):
+        value = self._marks.get(self._key)
+        return datetime.fromisoformat(value) if value else None
+
+    def update(self, time):
+        """
+        Moves the mark forward to time (an aware datetime) and saves it
+        """
+        current = self.get()
+        if time is None or (current is not None and time <= current):
+            return
+        self._marks[self._key] = time.isoformat()
+        self._save()
+
+    def clear(self):
+        if self._marks.pop(self._key, None) is not None:
+            self._save()
+        self.checked = False
+
+    def _save(self):
+        directory = os.path.dirname(self._file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self._file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self._marks, file)
+        os.replace(temp_path, self._file_path)
 
 
-def chunks(input_list, n):
+def chunks(iterable, n):
+    """
+    Lazily splits any iterable into lists of at most n items
+    """
     n = max(1, n)
-    return (input_list[i : i + n] for i in range(0, len(input_list), n))
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, n))
@@ -0,0 +1,405 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from ftplib import FTP, all_errors, error_perm, error_reply, error_temp
+
+from solarlog_exporter.instrumentation import FTP_RECEIVED_BYTES, FTP_REQUEST_SECONDS
+
+# bytes at the start and the end of a file remembered to detect prepended or appended data
+SAMPLE_SIZE = 256
+
+
+class StopTransfer(Exception):
+    """
+    Raised by a transfer callback which needs no more data, the transfer is aborted
+    """
+
+
+class FtpStateIndex:
+    """
+    Persistent index of the files imported from the Solar-Log FTP server
+    (file name -> size, modification time and consumed bytes)
+    """
+
+    def __init__(self, file_path):
+        self._file_path = file_path
+        self._files = {}
+        if os.path.isfile(file_path):
+            try:
+                with open(file_path, "r", encoding="utf-8") as file:
+                    self._files = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning("FTP state index %s not readable, starting empty: %s", file_path, e)
+
+    def get(self, file_name):
+        return self._files.get(file_name)
+
+    def is_unchanged(self, file_name, remote_stat):
+        entry = self._files.get(file_name)
+        if entry is None or remote_stat is None:
+            return False
+        size, mdtm = remote_stat
+        return entry.get("size") == size and entry.get("mdtm") == mdtm and mdtm is not None
+
+    def update(self, file_name, remote_stat, **extra):
+        size, mdtm = remote_stat if remote_stat is not None else (None, None)
+        entry = {"size": size, "mdtm": mdtm, "offset": size}
+        entry.update(extra)
+        self._files[file_name] = entry
+
+    def clear(self):
+        self._files = {}
+
+    def save(self):
+        directory = os.path.dirname(self._file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write to a temp file first, so a crash never leaves a half written index
+        temp_path = self._file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self._files, file)
+        os.replace(temp_path, self._file_path)
+
+
+def list_remote_files(ftp: FTP, path: str):
+    """
+    Returns {file name: (size, mdtm)} for a directory with a single MLSD command
+    or None if the server does not support MLSD
+    """
+    try:
+        with FTP_REQUEST_SECONDS.time(command="MLSD"):
+            return {
+                name: (int(facts["size"]) if "size" in facts else None, facts.get("modify"))
+                for name, facts in ftp.mlsd(path, facts=["size", "modify"])
+                if facts.get("type", "file") == "file"
+            }
+    except (error_perm, error_reply):
+        return None
+
+
+def get_remote_stat(ftp: FTP, ftp_file_path: str):
+    """
+    Returns (size, mdtm) of a single file using SIZE and MDTM, None if the server refuses both
+    """
+    size = None
+    mdtm = None
+    with FTP_REQUEST_SECONDS.time(command="STAT"):
+        try:
+            ftp.voidcmd("TYPE I")
+            size = ftp.size(ftp_file_path)
+        except (error_perm, error_reply):
+            pass
+        try:
+            mdtm = ftp.voidcmd("MDTM " + ftp_file_path)[4:].strip()
+        except (error_perm, error_reply):
+            pass
+    if size is None and mdtm is None:
+        return None
+    return size, mdtm
+
+
+def _hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _finish_transfer(ftp: FTP):
+    """
+    Reads the final reply of a data transfer. Servers answer an early closed transfer with 426.
+    """
+    try:
+        ftp.voidresp()
+    except (error_temp, error_reply, error_perm):
+        pass
+
+
+def fetch_range(ftp: FTP, ftp_file_path: str, offset=0, length=None, callback=None):
+    """
+    Retrieves length bytes (or everything) starting at offset with REST + binary RETR.
+    With a callback every block is passed on as it arrives and nothing is returned.
+    The callback may raise StopTransfer to close the data connection early.
+    The duration includes the time spent in the callback.
+    """
+    data = bytearray()
+    received = 0
+    with FTP_REQUEST_SECONDS.time(command="RETR"):
+        ftp.voidcmd("TYPE I")
+        try:
+            with ftp.transfercmd("RETR " + ftp_file_path, rest=offset or None) as conn:
+                while length is None or received < length:
+                    block = conn.recv(8192 if length is None else min(8192, length - received))
+                    if not block:
+                        break
+                    received += len(block)
+                    if callback is None:
+                        data += block
+                        continue
+                    try:
+                        callback(block)
+                    except StopTransfer:
+                        logging.debug("Transfer of %s stopped after %s bytes", ftp_file_path, received)
+                        break
+        finally:
+            FTP_RECEIVED_BYTES.inc(received, command="RETR")
+        _finish_transfer(ftp)
+    return bytes(data) if callback is None else None
+
+
+class _Sampler:
+    """
+    Passes blocks on and remembers size, first and last bytes of a transfer.
+    complete is the size up to the last newline and the tail ends there. With hold_back the bytes
+    behind the last newline (a line still being written) are not passed on.
+    """
+
+    def __init__(self, callback, hold_back=False):
+        self._callback = callback
+        self._hold_back = hold_back
+        self.size = 0
+        self.complete = 0
+        self.head = b""
+        self.tail = b""
+        self.stopped = False
+        # bytes behind the last newline, only the last SAMPLE_SIZE of them without hold_back
+        self._partial = b""
+
+    def __call__(self, block):
+        start = self.size
+        self.size += len(block)
+        if len(self.head) < SAMPLE_SIZE:
+            self.head = (self.head + block)[:SAMPLE_SIZE]
+        end = block.rfind(b"\n") + 1
+        if end:
+            lines = self._partial + block[:end]
+            self.complete = start + end
+            self.tail = (self.tail + lines[-SAMPLE_SIZE:])[-SAMPLE_SIZE:]
+            self._partial = block[end:]
+        else:
+            lines = b""
+            self._partial += block
+        if not self._hold_back:
+            self._partial = self._partial[-SAMPLE_SIZE:]
+            lines = block
+        if not lines:
+            return
+        try:
+            self._callback(lines)
+        except StopTransfer:
+            self.stopped = True
+            raise
+
+
+def _sample_state(head, tail):
+    return {"head": _hash(head), "head_size": len(head), "tail": _hash(tail), "tail_size": len(tail)}
+
+
+def fetch_new_data(ftp: FTP, ftp_file_path: str, entry, remote_stat, callback=None):
+    """
+    Fetches only the bytes added since the last import of a growing file.
+    Solar-Log prepends the newest lines, so the old head is looked up behind the new bytes first,
+    then the old tail at the old end (appended data). Everything else is fetched completely.
+    Returns (data, state for the index). With a callback the data is streamed to it and None is
+    returned instead of the data. If the callback stops the transfer, the rest of the file is
+    treated as consumed and the tail is unknown.
+    The offset in the state ends at the last newline, so a line still being written is fetched
+    again once it is complete. Appended bytes behind the last newline are not passed on.
+    """
+    blocks = []
+    sink = callback or blocks.append
+    size = remote_stat[0] if remote_stat is not None else None
+    offset = entry.get("offset") if entry else None
+    old_size = (entry.get("size") or offset) if entry else None
+
+    def result(state):
+        return (b"".join(blocks) if callback is None else None), state
+
+    if size is not None and offset and entry.get("head_size") and size > old_size:
+        delta = size - old_size
+
+        # prepended: the old head starts delta bytes into the file
+        old_head = fetch_range(ftp, ftp_file_path, delta, entry["head_size"])
+        if _hash(old_head) == entry["head"]:
+            data = fetch_range(ftp, ftp_file_path, 0, delta)
+            if len(data) == delta:
+                logging.debug("Fetched %s prepended bytes of %s", delta, ftp_file_path)
+                try:
+                    sink(data)
+                except StopTransfer:
+                    pass
+                state = _sample_state((data + old_head)[:SAMPLE_SIZE], b"")
+                state.update(offset=offset + delta, tail=entry["tail"], tail_size=entry["tail_size"])
+                return result(state)
+
+        # appended: the old tail still ends at the old offset
+        old_tail = fetch_range(ftp, ftp_file_path, offset - entry["tail_size"], entry["tail_size"]) \
+            if entry.get("tail_size") else None
+        if old_tail is not None and _hash(old_tail) == entry["tail"]:
+            sampler = _Sampler(sink, hold_back=True)
+            fetch_range(ftp, ftp_file_path, offset, callback=sampler)
+            logging.debug("Fetched %s appended bytes of %s", sampler.size, ftp_file_path)
+            state = _sample_state(b"", (old_tail + sampler.tail)[-SAMPLE_SIZE:])
+            state.update(offset=offset + sampler.complete, head=entry["head"], head_size=entry["head_size"])
+            return result(_stopped_state(state, sampler, size))
+
+    sampler = _Sampler(sink)
+    fetch_range(ftp, ftp_file_path, callback=sampler)
+    state = _sample_state(sampler.head, sampler.tail)
+    state.update(offset=sampler.complete)
+    return result(_stopped_state(state, sampler, size))
+
+
+def _stopped_state(state, sampler, size):
+    """
+    Adjusts the state of a transfer the callback stopped early: the unread rest counts as consumed
+    """
+    if not sampler.stopped:
+        return state
+    state.update(offset=size, tail=_hash(b""), tail_size=0)
+    return state
+
+
+def connect(host, user, passwd):
+    with FTP_REQUEST_SECONDS.time(command="LOGIN"):
+        ftp = FTP(host)
+        ftp.login(user=user or "", passwd=passwd or "")
+        ftp.sendcmd('OPTS UTF8 ON')
+    return ftp
+
+
+class FtpSession:
+    """
+    One logged in FTP connection kept open between uses (e.g. the polls of min_day.js),
+    so the Solar-Log does not see a new login every time. A connection which failed, e.g.
+    because the server closed it while idle, is replaced once.
+    """
+
+    def __init__(self, host, user, passwd):
+        self._host = host
+        self._user = user
+        self._passwd = passwd
+        self._ftp = None
+
+    def run(self, action):
+        """
+        Returns action(ftp) run on the connection
+        """
+        while True:
+            fresh = self._ftp is None
+            if fresh:
+                self._ftp = connect(self._host, self._user, self._passwd)
+            try:
+                return action(self._ftp)
+            except all_errors:
+                self.close()
+                if fresh:
+                    raise
+
+    def close(self):
+        if self._ftp is None:
+            return
+        try:
+            self._ftp.quit()
+        except all_errors:
+            self._ftp.close()
+        self._ftp = None
+
+
+class FtpConnectionPool:
+    """
+    Small pool of logged in FTP connections. Solar-Log devices only accept a few
+    parallel sessions, so the size should stay small.
+    """
+
+    def __init__(self, host, user, passwd, size, connections=()):
+        self._host = host
+        self._user = user
+        self._passwd = passwd
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._owned = []
+        for ftp in connections:
+            self._idle.put(ftp)
+            self._created += 1
+
+    @contextmanager
+    def connection(self):
+        ftp = None
+        with self._lock:
+            if self._idle.empty() and self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                ftp = connect(self._host, self._user, self._passwd)
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self._owned.append(ftp)
+        else:
+            ftp = self._idle.get()
+
+        try:
+            yield ftp
+        except all_errors:
+            # the state of the control connection is unknown after an error, replace it
+            with self._lock:
+                self._created -= 1
+                if ftp in self._owned:
+                    self._owned.remove(ftp)
+                    ftp.close()
+            raise
+        else:
+            self._idle.put(ftp)
+
+    def close(self):
+        with self._lock:
+            for ftp in self._owned:
+                try:
+                    ftp.quit()
+                except all_errors:
+                    ftp.close()
+            self._owned = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def fetch_in_order(pool: FtpConnectionPool, jobs, fetch):
+    """
+    Runs fetch(ftp, job) for all jobs on the pool connections and yields (job, result) in the
+    order of jobs. At most twice the pool size of files are downloaded ahead of the consumer.
+    """
+    window = pool.size * 2
+
+    def run(job):
+        with pool.connection() as ftp:
+            return fetch(ftp, job)
+
+    with ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="ftp-fetch") as executor:
+        pending = deque()
+        jobs = iter(jobs)
+        for job in jobs:
+            pending.append((job, executor.submit(run, job)))
+            if len(pending) >= window:
+                break
+        while pending:
+            job, future = pending.popleft()
+            result = future.result()
+            next_job = next(jobs, None)
+            if next_job is not None:
+                pending.append((next_job, executor.submit(run, next_job)))
+            yield job, result
@@ -0,0 +1,219 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+from solarlog_exporter import settings
+from solarlog_exporter.instrumentation import (INFLUX_BATCH_LINES, INFLUX_FAILED_WRITES, INFLUX_SPOOLED_LINES,
+                                               INFLUX_WRITE_SECONDS)
+from solarlog_exporter.line_protocol import to_bytes
+
+_FLUSH = object()
+_STOP = object()
+
+# longest pause between two attempts to write spooled batches
+MAX_DRAIN_DELAY = 60
+
+
+class InfluxConnection:
+    """
+    Long living InfluxDB client owned by the process. The query and the write api share one
+    HTTP connection pool, so connections are kept alive across files and import cycles.
+    """
+
+    def __init__(self, influx_host, influx_port, influx_org, influx_bucket, influx_token):
+        self.org = influx_org
+        self.bucket = influx_bucket
+        self._client = InfluxDBClient(
+            url=influx_host + ":" + influx_port,
+            token=influx_token,
+            org=influx_org)
+        self._query_api = None
+        self._write_api = None
+        self._closed = False
+
+    def query_api(self):
+        if self._query_api is None:
+            self._query_api = self._client.query_api()
+        return self._query_api
+
+    def write_api(self):
+        if self._write_api is None:
+            self._write_api = self._client.write_api(write_options=SYNCHRONOUS)
+        return self._write_api
+
+    def write_lines(self, lines):
+        self.write_api().write(
+            org=self.org,
+            bucket=self.bucket,
+            record=to_bytes(lines),
+            write_precision=WritePrecision.S)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._write_api is not None:
+            self._write_api.close()
+        self._client.close()
+        logging.debug("InfluxDB connection closed")
+
+
+class BatchWriter:
+    """
+    Writes line protocol to InfluxDB in a background thread, so downloading and parsing
+    continue while a batch is sent. The queue is bounded: write() blocks while it is full,
+    which slows the parser down to the speed of the database.
+
+    With a spool, batches which still fail after the retries are appended to it instead of
+    raising. While it holds data, new batches go straight to the spool until the database is
+    reachable again, then the spool is written oldest first.
+    """
+
+    def __init__(
+        self,
+        influx,
+        batch_size=settings.INFLUXDB_BATCH_SIZE,
+        flush_interval=settings.INFLUXDB_FLUSH_INTERVAL,
+        queue_size=settings.INFLUXDB_WRITE_QUEUE_SIZE,
+        max_retries=settings.INFLUXDB_WRITE_RETRIES,
+        retry_interval=settings.INFLUXDB_RETRY_INTERVAL,
+        spool=None
+    ):
+        self._influx = influx
+        self._spool = spool
+        self._spool_pending = spool is not None and not spool.is_empty()
+        self._drain_delay = retry_interval
+        self._next_drain = 0.0
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._retry_interval = retry_interval
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, lines):
+        self._raise_error()
+        self._queue.put(list(lines))
+
+    def flush(self):
+        """
+        Blocks until everything written so far is stored in InfluxDB (or durably in the spool)
+        """
+        self._queue.put(_FLUSH)
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            # the thread must survive every error, flush() and close() wait for it
+            try:
+                if item is None or item is _FLUSH or item is _STOP:
+                    try:
+                        self._write_batch(batch)
+                    finally:
+                        batch, deadline = [], None
+                        if self._spool is not None and item is _STOP:
+                            self._spool.close()
+                    if self._spool is not None and item is _FLUSH:
+                        self._spool.sync()
+                else:
+                    batch += item
+                    while len(batch) >= self._batch_size:
+                        self._write_batch(batch[:self._batch_size])
+                        batch = batch[self._batch_size:]
+                    if batch and deadline is None:
+                        deadline = time.monotonic() + self._flush_interval
+                    elif not batch:
+                        deadline = None
+            except Exception as e:
+                logging.error("Influxdb writer failed: %s", e)
+                self._error = e
+                batch, deadline = [], None
+            finally:
+                if item is not None:
+                    self._queue.task_done()
+            if item is _STOP:
+                return
+
+    def _write_batch(self, batch):
+        if self._spool_pending and not self._drain_spool():
+            if batch:
+                self._spool.append(batch)
+                INFLUX_SPOOLED_LINES.inc(len(batch))
+            return
+        if not batch:
+            return
+        for attempt in range(self._max_retries + 1):
+            try:
+                with INFLUX_WRITE_SECONDS.time():
+                    self._influx.write_lines(batch)
+                INFLUX_BATCH_LINES.observe(len(batch))
+                logging.debug("Datapoints in influxdb saved: %s", len(batch))
+                return
+            except Exception as e:
+                INFLUX_FAILED_WRITES.inc()
+                if attempt >= self._max_retries:
+                    if self._spool is not None:
+                        logging.warning("Writing to influxdb failed (%s), spooling %s datapoints", e, len(batch))
+                        self._spool.append(batch)
+                        INFLUX_SPOOLED_LINES.inc(len(batch))
+                        self._spool_pending = True
+                        self._next_drain = time.monotonic() + self._drain_delay
+                        return
+                    logging.error("Writing %s datapoints to influxdb failed: %s", len(batch), e)
+                    self._error = e
+                    return
+                # exponential backoff with jitter, so restarted databases are not hit by all writers at once
+                delay = self._retry_interval * (2 ** attempt)
+                delay += random.uniform(0, delay)
+                logging.warning("Write to influxdb failed (%s), retrying in %.1f s", e, delay)
+                time.sleep(delay)
+
+    def _drain_spool(self):
+        """
+        Writes the spooled batches oldest first. Returns False while influxdb is still not reachable,
+        the next attempt is delayed exponentially then.
+        """
+        if time.monotonic() < self._next_drain:
+            return False
+        try:
+            for path in self._spool.segments():
+                # a segment is removed once it is written completely, writing it again is harmless
+                for spooled in self._spool.read(path):
+                    self._influx.write_lines(spooled)
+                self._spool.remove(path)
+        except Exception as e:
+            self._drain_delay = min(self._drain_delay * 2, MAX_DRAIN_DELAY)
+            self._next_drain = time.monotonic() + self._drain_delay
+            logging.warning("Spooled datapoints not written (%s), next attempt in %.0f s", e, self._drain_delay)
+            return False
+        logging.info("Spooled datapoints written to influxdb")
+        self._spool_pending = False
+        self._drain_delay = self._retry_interval
+        return True
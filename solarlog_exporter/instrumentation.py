@@ -0,0 +1,215 @@
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (10, 100, 1000, 5000, 10000, 50000)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    """
+    Label pairs of the Prometheus text format from (name, value) items, without the braces
+    """
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+
+
+def _format_labels(labelnames, labelvalues, le=None):
+    labels = list(zip(labelnames, labelvalues))
+    if le is not None:
+        labels.append(("le", le))
+    return "{" + format_labels(labels) + "}" if labels else ""
+
+
+class Counter:
+    """
+    Monotonic counter, one value per combination of label values
+    """
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """
+        Value of the given labels, the sum over all values without labels
+        """
+        with self._lock:
+            if labels:
+                return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+            return sum(self._values.values())
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} counter")
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, one per combination of label values
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [count per bucket, count, sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the block in seconds
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        return self._total(1, labels)
+
+    def sum(self, **labels):
+        return self._total(2, labels)
+
+    def _total(self, index, labels):
+        with self._lock:
+            if labels:
+                entry = self._values.get(tuple(labels[name] for name in self.labelnames))
+                return entry[index] if entry else 0
+            return sum(entry[index] for entry in self._values.values())
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        with self._lock:
+            for key, (bucket_counts, count, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, "+Inf")
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+
+
+FTP_REQUEST_SECONDS = Histogram(
+    "solarlog_exporter_ftp_request_seconds", "Duration of FTP logins, listings, stat requests and transfers", ("command",))
+FTP_RECEIVED_BYTES = Counter(
+    "solarlog_exporter_ftp_received_bytes_total", "Bytes received in FTP transfers", ("command",))
+LINES = Counter(
+    "solarlog_exporter_lines_total", "Record lines read, new or skipped as not newer than the last record",
+    ("file_type", "result"))
+DATAPOINTS = Counter("solarlog_exporter_datapoints_total", "Datapoints built from the record lines")
+SERIALIZATION_SECONDS = Histogram(
+    "solarlog_exporter_serialization_seconds",
+    "Time to build and encode the datapoints of a file, without waiting for the writer")
+INFLUX_WRITE_SECONDS = Histogram("solarlog_exporter_influx_write_seconds", "Duration of InfluxDB write requests")
+INFLUX_BATCH_LINES = Histogram(
+    "solarlog_exporter_influx_batch_lines", "Lines per InfluxDB write request", buckets=SIZE_BUCKETS)
+INFLUX_FAILED_WRITES = Counter("solarlog_exporter_influx_failed_writes_total", "Failed InfluxDB write requests")
+INFLUX_SPOOLED_LINES = Counter("solarlog_exporter_influx_spooled_lines_total", "Lines appended to the spool")
+
+INSTRUMENTS = (
+    FTP_REQUEST_SECONDS, FTP_RECEIVED_BYTES, LINES, DATAPOINTS, SERIALIZATION_SECONDS,
+    INFLUX_WRITE_SECONDS, INFLUX_BATCH_LINES, INFLUX_FAILED_WRITES, INFLUX_SPOOLED_LINES,
+)
+
+
+def render():
+    """
+    All instruments in the Prometheus text format
+    """
+    lines = []
+    for instrument in INSTRUMENTS:
+        instrument.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+def count_points(points):
+    """
+    Passes the points on and adds their number to DATAPOINTS once they are consumed
+    """
+    count = 0
+    try:
+        for count, point in enumerate(points, 1):
+            yield point
+    finally:
+        DATAPOINTS.inc(count)
+
+
+def count_batches(batches):
+    """
+    Passes PointBatches on and adds their number of samples to DATAPOINTS once they are consumed
+    """
+    count = 0
+    try:
+        for batch in batches:
+            count += len(batch.epochs)
+            yield batch
+    finally:
+        DATAPOINTS.inc(count)
+
+
+def sample():
+    """
+    Totals of the instruments, the start of a cycle for cycle_summary()
+    """
+    return {
+        "retr": FTP_REQUEST_SECONDS.count(command="RETR"),
+        "ftp_seconds": FTP_REQUEST_SECONDS.sum(),
+        "bytes": FTP_RECEIVED_BYTES.value(),
+        "new": LINES.value(result="new", file_type="min") + LINES.value(result="new", file_type="day"),
+        "skipped": LINES.value(result="skipped", file_type="min") + LINES.value(result="skipped", file_type="day"),
+        "datapoints": DATAPOINTS.value(),
+        "serialization_seconds": SERIALIZATION_SECONDS.sum(),
+        "writes": INFLUX_WRITE_SECONDS.count(),
+        "write_seconds": INFLUX_WRITE_SECONDS.sum(),
+        "failed_writes": INFLUX_FAILED_WRITES.value(),
+        "spooled": INFLUX_SPOOLED_LINES.value(),
+    }
+
+
+def cycle_summary(before):
+    """
+    One line about everything counted since before (a sample())
+    """
+    now = sample()
+    delta = {key: now[key] - before[key] for key in now}
+    return (
+        "{retr} ftp transfers ({bytes} bytes), {ftp_seconds:.2f} s in ftp requests, {new} lines read, {skipped} skipped, "
+        "{datapoints} datapoints built and encoded in {serialization_seconds:.2f} s, "
+        "{writes} influxdb writes in {write_seconds:.2f} s ({failed_writes} failed, {spooled} lines spooled)"
+    ).format(**delta)
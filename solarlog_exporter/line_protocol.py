@@ -0,0 +1,155 @@
+import math
+from functools import lru_cache
+
+_ESCAPE_MEASUREMENT = str.maketrans({
+    ',': r'\,',
+    ' ': r'\ ',
+    '\n': r'\n',
+    '\t': r'\t',
+    '\r': r'\r',
+})
+
+_ESCAPE_KEY = str.maketrans({
+    ',': r'\,',
+    '=': r'\=',
+    ' ': r'\ ',
+    '\n': r'\n',
+    '\t': r'\t',
+    '\r': r'\r',
+})
+
+
+def escape_measurement(measurement):
+    return str(measurement).translate(_ESCAPE_MEASUREMENT)
+
+
+def escape_key(key):
+    return str(key).translate(_ESCAPE_KEY)
+
+
+def format_tags(measurement, tags):
+    """
+    Returns the escaped "measurement,tag=value,..." prefix of a line, tags sorted like influxdb_client does
+    """
+    parts = [escape_measurement(measurement)]
+    for key, value in sorted(tags.items()):
+        if value is None or value == '':
+            continue
+        parts.append(f"{escape_key(key)}={escape_key(value)}")
+    return ",".join(parts)
+
+
+def format_value(value):
+    """
+    Returns a field value in line protocol, None for values influxdb does not accept (nan, inf)
+    """
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return None
+        formatted = str(value)
+        if formatted.endswith('.0'):
+            formatted = formatted[:-2]
+        return formatted
+    raise ValueError(f'Type: "{type(value)}" of field value: "{value}" is not supported.')
+
+
+def _format_float(value):
+    formatted = str(value)
+    if formatted.endswith('.0'):
+        return formatted[:-2]
+    return formatted if math.isfinite(value) else None
+
+
+_format_int = "{}i".format
+
+
+def _column_formatter(column):
+    """
+    Formatter of the values of a column, arrays of floats ("d") and integers ("q") need no check per value
+    """
+    typecode = getattr(column, "typecode", None)
+    if typecode == "d":
+        return _format_float
+    if typecode == "q":
+        return _format_int
+    return format_value
+
+
+class LineFormat:
+    """
+    Fields of a measurement: the keys are escaped and sorted like influxdb_client does once,
+    the values of a line are passed positionally in the order of field_names
+    """
+
+    def __init__(self, field_names):
+        self.field_names = tuple(field_names)
+        self._order = sorted(range(len(self.field_names)), key=self.field_names.__getitem__)
+        self._keys = [escape_key(self.field_names[index]) + "=" for index in self._order]
+
+    def format(self, prefix, values, epoch):
+        """
+        Builds one line with the precomputed prefix, the values and a timestamp in seconds
+        """
+        formatted = map(format_value, [values[index] for index in self._order])
+        fields = [key + value for key, value in zip(self._keys, formatted) if value is not None]
+        return f"{prefix} {','.join(fields)} {epoch}"
+
+    def format_rows(self, prefix, epochs, columns):
+        """
+        Lazily builds one line per row of value columns (in the order of field_names).
+        The fields are formatted column by column, typed arrays without a check of the type per value.
+        """
+        fields = [
+            [None if value is None else key + value for value in map(_column_formatter(column), column)]
+            for key, column in zip(self._keys, [columns[index] for index in self._order])
+        ]
+        complete = not any(None in column for column in fields)
+        for epoch, *row in zip(epochs, *fields):
+            if not complete:
+                row = [field for field in row if field is not None]
+            yield f"{prefix} {','.join(row)} {epoch}"
+
+
+@lru_cache(maxsize=None)
+def line_format(field_names):
+    """
+    Shared LineFormat of a tuple of field names
+    """
+    return LineFormat(field_names)
+
+
+def to_bytes(lines):
+    return "\n".join(lines).encode("utf-8")
+
+
+def to_line_protocol(points):
+    """
+    Lazily formats points, the prefix and the field keys are built once per measurement and tags dict
+    """
+    prefixes = {}
+    for measurement, tags, field_names, values, epoch in points:
+        cached = prefixes.get((measurement, id(tags)))
+        if cached is None:
+            # the tags are kept in the cache, so their id can not be reused by another dict
+            cached = prefixes[measurement, id(tags)] = (tags, format_tags(measurement, tags), line_format(field_names))
+        fields = cached[2]
+        if fields.field_names is not field_names:
+            # the same measurement with other fields
+            fields = line_format(field_names)
+        yield fields.format(cached[1], values, epoch)
+
+
+def batches_to_line_protocol(batches):
+    """
+    Lazily formats PointBatches straight from their columns, the prefix is built once per measurement and tags dict
+    """
+    prefixes = {}
+    for measurement, tags, field_names, epochs, columns in batches:
+        cached = prefixes.get((measurement, id(tags)))
+        if cached is None:
+            cached = prefixes[measurement, id(tags)] = (tags, format_tags(measurement, tags))
+        yield from line_format(field_names).format_rows(cached[1], epochs, columns)
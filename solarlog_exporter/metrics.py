@@ -0,0 +1,150 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from solarlog_exporter import instrumentation
+from solarlog_exporter.instrumentation import format_labels
+from solarlog_exporter.sinks import Sink
+from solarlog_exporter.utils import MinDatapoint, Point, StringDatapoint
+
+# measurement -> (field, metric name, help text)
+METRICS = {
+    MinDatapoint.influx_measurment_name: (
+        ("Pac", "solarlog_pac_watts", "AC power of the inverter"),
+        ("Eday", "solarlog_eday_watthours", "AC energy of the inverter today"),
+        ("temperature", "solarlog_temperature_celsius", "Temperature of the inverter"),
+    ),
+    StringDatapoint.influx_measurment_name: (
+        ("Pdc", "solarlog_string_pdc_watts", "DC power of the string"),
+        ("Udc", "solarlog_string_udc_volts", "DC voltage of the string"),
+    ),
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class SnapshotSink(Sink):
+    """
+    Keeps only the newest minute and string sample per inverter (and string), so rendering the
+    metrics costs O(inverters) and never touches FTP or InfluxDB
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._text = None
+
+    @staticmethod
+    def encode(points):
+        return [point for point in points if point.measurement in METRICS]
+
+    def write_encoded(self, points):
+        for _ in self.observe(points):
+            pass
+
+    def observe(self, points):
+        """
+        Passes the points on and takes the newest of them into the snapshot once they are consumed
+        """
+        # the tags dicts are shared per inverter and string, the kept points keep their ids valid
+        newest = {}
+        try:
+            for point in points:
+                if point.measurement in METRICS:
+                    key = (point.measurement, id(point.tags))
+                    latest = newest.get(key)
+                    if latest is None or point.epoch >= latest.epoch:
+                        newest[key] = point
+                yield point
+        finally:
+            self._update(newest.values())
+
+    def observe_batches(self, batches):
+        """
+        Passes PointBatches on and takes the newest row of each of them into the snapshot once they are consumed
+        """
+        newest = []
+        try:
+            for batch in batches:
+                if batch.measurement in METRICS and batch.epochs:
+                    epochs = batch.epochs
+                    row = max(range(len(epochs)), key=epochs.__getitem__)
+                    newest.append(Point(batch.measurement, batch.tags, batch.field_names,
+                                        tuple(column[row] for column in batch.columns), epochs[row]))
+                yield batch
+        finally:
+            self._update(newest)
+
+    def _update(self, points):
+        with self._lock:
+            for point in points:
+                key = (point.measurement, format_labels(sorted(point.tags.items())))
+                latest = self._latest.get(key)
+                if latest is None or point.epoch >= latest[1]:
+                    self._latest[key] = (point.fields, point.epoch)
+                    self._text = None
+
+    def render(self):
+        """
+        Current values in the Prometheus text format
+        """
+        with self._lock:
+            if self._text is None:
+                self._text = self._render()
+            return self._text
+
+    def _render(self):
+        lines = []
+        samples = sorted(self._latest.items())
+        for measurement, metrics in METRICS.items():
+            for field, name, help_text in metrics:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for (sample_measurement, labels), (fields, _) in samples:
+                    if sample_measurement == measurement and fields.get(field) is not None:
+                        lines.append(f"{name}{{{labels}}} {float(fields[field])}")
+        lines.append("# HELP solarlog_sample_timestamp_seconds Time of the newest sample of the inverter")
+        lines.append("# TYPE solarlog_sample_timestamp_seconds gauge")
+        for (measurement, labels), (_, epoch) in samples:
+            if measurement == MinDatapoint.influx_measurment_name:
+                lines.append(f"solarlog_sample_timestamp_seconds{{{labels}}} {epoch}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MetricsServer:
+    """
+    Serves the snapshot and the instruments of the exporter on http://host:port/metrics
+    from a background thread
+    """
+
+    def __init__(self, snapshot, host, port):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = snapshot.render() + instrumentation.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("metrics: " + format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        logging.info("Metrics served on port %s", self.port)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
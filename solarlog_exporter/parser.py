@@ -1,15 +1,59 @@
 from ftplib import FTP
 import ftplib
+import hashlib
+import json
 import logging
+import mmap
 import os
 from abc import abstractmethod
-from typing import List
-
-import pyjsparser
+import re
 
 from solarlog_exporter import settings
-from solarlog_exporter.utils import MinDatapoint, DayDatapoint, InverterList, StringDatapoint
+from solarlog_exporter.ftp_sync import StopTransfer, fetch_range
+from solarlog_exporter.line_protocol import batches_to_line_protocol
+from solarlog_exporter.utils import (MinDatapoint, DayDatapoint, InverterColumns, InverterList, StringDatapoint,
+                                     iter_batch_points)
 from solarlog_exporter.utils import FileType
+from solarlog_exporter.timestamps import parse_day_time, parse_min_time, to_local_sortable, to_sortable
+
+
+class EndOfNewData(StopTransfer):
+    """
+    Raised by a parser when the rest of a newest-first file only holds already imported lines
+    """
+
+
+class LineStream:
+    """
+    Splits the blocks of a binary transfer into lines and hands each complete line to the parser
+    """
+
+    def __init__(self, parse_line, encoding='ISO-8859-1'):
+        self._parse_line = parse_line
+        self._encoding = encoding
+        self._rest = b""
+        self.stopped = False
+
+    def __call__(self, block: bytes):
+        if self.stopped:
+            raise EndOfNewData()
+        lines = (self._rest + block).split(b"\n")
+        self._rest = lines.pop()
+        try:
+            for line in lines:
+                self._parse_line(line.rstrip(b"\r").decode(self._encoding))
+        except EndOfNewData:
+            self.stopped = True
+            self._rest = b""
+            raise
+
+    def close(self):
+        if self._rest and not self.stopped:
+            try:
+                self._parse_line(self._rest.rstrip(b"\r").decode(self._encoding))
+            except EndOfNewData:
+                self.stopped = True
+            self._rest = b""
 
 
 class Parser:
@@ -22,26 +66,162 @@ class Parser:
             logging.error("File is not under path %s", file_path)
             return
 
-        file = open(file_path, "r", encoding='ISO-8859-1')
-        for line in file:
-            self._parse_line(line)
-        file.close()
+        self._start_file()
+        with open(file_path, "r", encoding='ISO-8859-1') as file:
+            try:
+                for line in file:
+                    self._parse_line(line)
+            except EndOfNewData:
+                logging.debug("Stopped reading %s at the last record", file_path)
 
     def parse_ftp_file(self, ftp: FTP, ftp_file_path: str):
         try:
-            string_list: List[str] = []
-            ftp.retrlines(f'RETR {ftp_file_path}', string_list.append)
-            for line in string_list:
-                self._parse_line(line)
+            # a stream stopped at the last record closes the data connection early
+            stream = self.line_stream(ftp.encoding)
+            fetch_range(ftp, ftp_file_path, callback=stream)
+            stream.close()
         except ftplib.error_perm:
             logging.error("File is not under path %s", ftp_file_path)
             return
 
+    def line_stream(self, encoding='ISO-8859-1'):
+        """
+        Callback for binary transfers which parses every line as soon as it is complete
+        """
+        self._start_file()
+        return LineStream(self._parse_line, encoding)
+
+    def parse_bytes(self, data: bytes, encoding='ISO-8859-1'):
+        self._start_file()
+        try:
+            for line in data.decode(encoding).splitlines():
+                self._parse_line(line)
+        except EndOfNewData:
+            pass
+
+    def _start_file(self):
+        """
+        Called before the first line of every file
+        """
+
     @abstractmethod
     def _parse_line(self, line):
         pass
 
 
+_STATEMENT = re.compile(r'^\s*(var\s+)?([A-Za-z_$][\w$]*)((?:\s*\[\s*\d+\s*\])*)\s*=(.*)$', re.S)
+_INDEX = re.compile(r'\[\s*(\d+)\s*\]')
+_NEW_ARRAY = re.compile(r'^new\s+Array\s*\((.*)\)$', re.S)
+_NUMBER = re.compile(r'^(?:\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)$')
+_NOT_LITERAL = re.compile(r'^(?:[A-Za-z_$][\w$]*|-\s*(?:\d+\.?\d*|\.\d+))$')
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "v": "\v", "0": "\0"}
+_CONSTANTS = {"true": True, "false": False, "null": None}
+_STRINGS = {
+    '"': re.compile(r'"((?:[^"\\\n]|\\.)*)"'),
+    "'": re.compile(r"'((?:[^'\\\n]|\\.)*)'"),
+}
+
+
+class _NotLiteral:
+    """
+    Value which is valid in base_vars.js but not a literal (identifier, negative number)
+    """
+
+
+class _Unsupported(Exception):
+    """
+    Raised for syntax the fast reader does not know, the line is handed to pyjsparser
+    """
+
+
+def _unescape(text):
+    result = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char != "\\":
+            result.append(char)
+            i += 1
+            continue
+        if i + 1 >= len(text):
+            raise _Unsupported()
+        escaped = text[i + 1]
+        if escaped == "u" and re.match(r"[0-9a-fA-F]{4}$", text[i + 2:i + 6]):
+            result.append(chr(int(text[i + 2:i + 6], 16)))
+            i += 6
+        elif escaped == "x" and re.match(r"[0-9a-fA-F]{2}$", text[i + 2:i + 4]):
+            result.append(chr(int(text[i + 2:i + 4], 16)))
+            i += 4
+        else:
+            result.append(_ESCAPES.get(escaped, escaped))
+            i += 2
+    return "".join(result)
+
+
+def _read_string(text, start):
+    """
+    Returns (value, end) of the string literal starting at text[start]
+    """
+    string = _STRINGS[text[start]].match(text, start)
+    if not string:
+        raise _Unsupported()
+    value = string.group(1)
+    return (_unescape(value) if "\\" in value else value), string.end()
+
+
+def _read_value(text):
+    """
+    Reads a literal, an identifier or a negative number (returned as _NotLiteral)
+    """
+    text = text.strip()
+    if not text:
+        raise _Unsupported()
+    if text[0] in "\"'":
+        value, end = _read_string(text, 0)
+        if text[end:].strip():
+            raise _Unsupported()
+        return value
+    if text in _CONSTANTS:
+        return _CONSTANTS[text]
+    if _NUMBER.match(text):
+        return float(text)
+    if _NOT_LITERAL.match(text):
+        return _NotLiteral
+    raise _Unsupported()
+
+
+def _split_arguments(text):
+    arguments = []
+    start = 0
+    i = 0
+    while i < len(text):
+        if text[i] in "\"'":
+            _, i = _read_string(text, i)
+            continue
+        if text[i] in "()[]{}":
+            raise _Unsupported()
+        if text[i] == ",":
+            arguments.append(text[start:i])
+            start = i + 1
+        i += 1
+    arguments.append(text[start:])
+    if len(arguments) == 1 and not arguments[0].strip():
+        return []
+    return arguments
+
+
+def _read_expression(text):
+    """
+    Returns the value of a literal, the list of literal arguments of "new Array(...)"
+    or _NotLiteral for everything else Solar-Log writes
+    """
+    new_array = _NEW_ARRAY.match(text)
+    if new_array:
+        values = [_read_value(argument) for argument in _split_arguments(new_array.group(1))]
+        return [value for value in values if value is not _NotLiteral]
+    return _read_value(text)
+
+
 class ConfigParser(Parser):
     """s
     Parser for config file (base_vars.js)
@@ -51,6 +231,66 @@ class ConfigParser(Parser):
         self._config = {}
 
     def _parse_line(self, line):
+        try:
+            self._read_statement(line)
+        except _Unsupported:
+            self._parse_line_with_pyjsparser(line)
+
+    def _read_statement(self, line):
+        """
+        Fast reader for the statements written to base_vars.js, fills _config exactly like the
+        pyjsparser based reader: var X = literal, var X = new Array(...), X[i] = ..., X[i][6] = ...
+        and X[i][j][k] = ...
+        """
+        stripped = line.strip()
+        if not stripped or stripped.startswith("//"):
+            return
+
+        statement = _STATEMENT.match(stripped)
+        if not statement:
+            raise _Unsupported()
+        declaration, name, indices, expression = statement.groups()
+        expression = expression.strip()
+        if expression.endswith(";"):
+            expression = expression[:-1].rstrip()
+        indices = _INDEX.findall(indices)
+        value = _read_expression(expression)
+
+        if declaration:
+            if indices:
+                raise _Unsupported()
+            if value is not _NotLiteral:
+                self._config[name] = value
+            return
+
+        if value is _NotLiteral:
+            value = 0
+
+        if len(indices) == 1:
+            if not self._config.get(name):
+                self._config[name] = []
+            self._config[name].append([value])
+        elif len(indices) == 2:
+            if indices[1] == "6":
+                wr_index = int(indices[0])
+                if len(self._config[name][wr_index]) == 1:
+                    self._config[name][wr_index].append('nogroup')
+                self._config[name][wr_index].append(value)
+        elif len(indices) == 3:
+            index_2 = int(indices[0])
+            if not self._config.get(name):
+                self._config[name] = []
+            if len(self._config[name][index_2]) < 2:
+                self._config[name][index_2].append([])
+            self._config[name][index_2][1].append(value)
+
+    def _parse_line_with_pyjsparser(self, line):
+        try:
+            import pyjsparser
+        except ImportError:
+            logging.warning("Line not understood and pyjsparser is not installed: %s", line.strip())
+            return
+
         _parsed_config = pyjsparser.parse(line)
 
         for i in _parsed_config["body"]:
@@ -170,28 +410,244 @@ class ConfigParser(Parser):
     def get_inverters(self):
         return InverterList(self.get_inverter_config(), self.get_title())
 
+    @classmethod
+    def from_config(cls, config):
+        config_parser = cls()
+        config_parser._config = config
+        return config_parser
+
 
-class DataParser(Parser):
+class ConfigCache:
     """
-    Simple parser for minute and day-data
+    Parsed base_vars.js per path, kept in memory and optionally on disk. The file is only
+    downloaded again if its size or modification time changed and only parsed again if its
+    content hash changed.
     """
 
-    def __init__(self, inverters, last_record_time):
-        self._inverters = inverters
-        self._last_record_time = last_record_time
+    def __init__(self, file_path=None):
+        self._file_path = file_path
+        self._entries = {}
+        if file_path and os.path.isfile(file_path):
+            try:
+                with open(file_path, "r", encoding="utf-8") as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning("Config cache %s not readable, starting empty: %s", file_path, e)
+
+    def _lookup(self, path, stat):
+        entry = self._entries.get(path)
+        if entry is not None and stat is not None and entry["stat"] == list(stat):
+            logging.debug("Config %s unchanged, using cached config", path)
+            return ConfigParser.from_config(entry["config"])
+        return None
+
+    def _parse(self, path, stat, data, encoding):
+        content_hash = hashlib.sha1(data).hexdigest()
+        entry = self._entries.get(path)
+        if entry is None or entry["hash"] != content_hash:
+            config_parser = ConfigParser()
+            config_parser.parse_bytes(data, encoding)
+            entry = {"hash": content_hash, "config": config_parser._config}
+            logging.debug("Config %s parsed", path)
+        entry["stat"] = list(stat) if stat is not None else None
+        self._entries[path] = entry
+        self._save()
+        return ConfigParser.from_config(entry["config"])
+
+    def _save(self):
+        if not self._file_path:
+            return
+        directory = os.path.dirname(self._file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self._file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self._entries, file)
+        os.replace(temp_path, self._file_path)
+
+    def get_file(self, file_path):
+        stat = os.stat(file_path)
+        stat = (stat.st_size, stat.st_mtime_ns)
+        config_parser = self._lookup(file_path, stat)
+        if config_parser is None:
+            with open(file_path, "rb") as file:
+                config_parser = self._parse(file_path, stat, file.read(), 'ISO-8859-1')
+        return config_parser
+
+    def get_ftp_file(self, ftp: FTP, ftp_file_path: str, stat):
+        config_parser = self._lookup(ftp_file_path, stat)
+        if config_parser is None:
+            data = fetch_range(ftp, ftp_file_path)
+            config_parser = self._parse(ftp_file_path, stat, data, ftp.encoding)
+        return config_parser
+
+
+class RecordCutoff:
+    """
+    Drops lines which are not newer than the last record before anything is built from them,
+    by comparing the raw time string of the line. Minute lines must be newer than the last
+    record, day lines are kept from the day of the last record on (its total still grows).
+
+    Solar-Log writes the minute lines newest first, so with early_exit the first old minute line
+    ends the file (EndOfNewData). The order is checked up front: a file only ends early once its
+    first two minute lines are newest first. Day files get rows appended after older ones, they
+    are always read completely. A file seen in any other order later on switches early exit off
+    for good.
+    """
+
+    def __init__(self, last_record_time, early_exit=False):
+        self._min_key = to_local_sortable(last_record_time)
+        self._day_key = self._min_key[:6]
+        self.early_exit = early_exit
+        # record lines checked and skipped per file type
+        self.lines = {FileType.MIN: 0, FileType.DAY: 0}
+        self.skipped_lines = {FileType.MIN: 0, FileType.DAY: 0}
+        # time string of the newest minute line which passed
+        self.newest = None
+        self._newest_key = None
+        self._previous_key = None
+        # first minute line of the file and whether the second one is older
+        self._first_min_key = None
+        self._newest_first = None
+
+    @property
+    def skipped(self):
+        return sum(self.skipped_lines.values())
+
+    def start_file(self):
+        self._previous_key = None
+        self._first_min_key = None
+        self._newest_first = None
+
+    def merge(self, other):
+        """
+        Adds the lines and the newest minute line of the cutoff of another parser of the same cycle
+        """
+        for file_type in self.lines:
+            self.lines[file_type] += other.lines[file_type]
+            self.skipped_lines[file_type] += other.skipped_lines[file_type]
+        if other._newest_key is not None and (self._newest_key is None or other._newest_key > self._newest_key):
+            self._newest_key = other._newest_key
+            self.newest = other.newest
+        self.early_exit = self.early_exit and other.early_exit
+
+    def get_newest_time(self):
+        """
+        Localized time of the newest minute line which passed, None if there was none
+        """
+        return parse_min_time(self.newest).date_time if self.newest else None
+
+    def is_new(self, file_type, line):
+        start = line.find('"') + 1
+        if start == 0:
+            return True
+        return self.is_new_time(file_type, line[start:start + (17 if file_type == FileType.MIN else 8)])
+
+    def is_new_time(self, file_type, time_string):
+        self.lines[file_type] += 1
+        if file_type == FileType.MIN:
+            if len(time_string) < 17:
+                return True
+            key = to_sortable(time_string)
+            is_new = key > self._min_key
+            if is_new and (self._newest_key is None or key > self._newest_key):
+                self._newest_key = key
+                self.newest = time_string
+            if self._first_min_key is None:
+                self._first_min_key = key
+            elif self._newest_first is None:
+                self._newest_first = key < self._first_min_key
+        else:
+            if len(time_string) < 8:
+                return True
+            key = to_sortable(time_string)
+            is_new = key >= self._day_key
+
+        if self._previous_key is not None and key > self._previous_key and self.early_exit:
+            logging.warning("Lines are not sorted newest first (%s), reading files completely", time_string)
+            self.early_exit = False
+        self._previous_key = key
+
+        if not is_new:
+            self.skipped_lines[file_type] += 1
+            if self.early_exit and file_type == FileType.MIN and self._newest_first:
+                raise EndOfNewData()
+        return is_new
+
+
+# prefix, file type and length of the time string of the min and day records
+_RECORD_TYPES = ((b'm[mi++]="', FileType.MIN, 17), (b'da[dx++]="', FileType.DAY, 8))
+
+
+class RecordParser(Parser):
+    """
+    Base for the min/day-data parsers. Local files are memory mapped and scanned as bytes,
+    only the time of a record is decoded until the record turns out to be new.
+    """
+
+    def parse_file(self, file_path):
+        if not os.path.isfile(file_path):
+            logging.error("File is not under path %s", file_path)
+            return
+
+        self._start_file()
+        with open(file_path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                try:
+                    self._parse_records(data)
+                except EndOfNewData:
+                    logging.debug("Stopped reading %s at the last record", file_path)
+
+    def _parse_records(self, data):
+        for line in iter(data.readline, b""):
+            for prefix, file_type, time_length in _RECORD_TYPES:
+                if line.startswith(prefix):
+                    break
+            else:
+                continue
+            start = len(prefix)
+            if self.cutoff.is_new_time(file_type, line[start:start + time_length].decode('ISO-8859-1')):
+                self._parse_record(file_type, line.rstrip(b"\r\n").decode('ISO-8859-1'))
 
     def _parse_line(self, line):
         file_type = FileType.get_filetype(line)
-        if file_type is None:
+        if file_type is None or not self.cutoff.is_new(file_type, line):
             return
+        self._parse_record(file_type, line)
+
+    @abstractmethod
+    def _parse_record(self, file_type, line):
+        pass
 
+    def _start_file(self):
+        self.cutoff.start_file()
+
+
+class DataParser(RecordParser):
+    """
+    Simple parser for minute and day-data
+    """
+
+    def __init__(self, inverters, last_record_time, early_exit=settings.EARLY_EXIT):
+        self._inverters = inverters
+        self._last_record_time = last_record_time
+        self.cutoff = RecordCutoff(last_record_time, early_exit)
+
+    def _parse_record(self, file_type, line):
         record = line.split("=")[1].strip("\n").strip('\"')
         parts = record.split("|")
-        date_time = parts[0]
 
         if len(parts)-1 > len(self._inverters.inverters):
             return
 
+        # convert the time once per line, all datapoints of this line share it
+        if file_type == FileType.DAY:
+            date_time = parse_day_time(parts[0])
+        else:
+            date_time = parse_min_time(parts[0])
+
         for i in range(1, len(parts)):
             values = parts[i].split(";")
             # AC Leistung; DC String 1; DC String 2; AC Tagesertrag; DC V String 1;DC V String 2; Temperatur
@@ -215,3 +671,75 @@ class DataParser(Parser):
                 self._inverters.get_inverter(i - 1).add_datapoint(datapoint, self._last_record_time)
             else:
                 logging.error("This filetype is not supported!")
+
+    def get_datapoints_to_influx(self):
+        return self._inverters.get_inverter_datapoints_to_influx()
+
+    def get_line_protocol(self):
+        return self._inverters.get_inverter_line_protocol()
+
+    def drain_points(self):
+        """
+        Lazily yields the points of everything parsed so far and forgets them afterwards
+        """
+        return self._inverters.drain_inverter_points()
+
+
+class ColumnarDataParser(RecordParser):
+    """
+    Parser for minute and day-data which stores the values column-wise per inverter
+    instead of creating one datapoint object per sample
+    """
+
+    def __init__(self, inverters, last_record_time, early_exit=settings.EARLY_EXIT):
+        self._inverters = inverters
+        self._last_record_time = last_record_time
+        self._columns = [InverterColumns(inverter) for inverter in inverters.inverters]
+        self.cutoff = RecordCutoff(last_record_time, early_exit)
+
+    def _parse_record(self, file_type, line):
+        record = line.split("=")[1].strip("\n").strip('\"')
+        parts = record.split("|")
+        date_time = parts[0]
+
+        if len(parts)-1 > len(self._columns):
+            return
+
+        for i in range(1, len(parts)):
+            values = parts[i].split(";")
+            columns = self._columns[i - 1]
+            if file_type == FileType.MIN:
+                string_count = len(columns.string_names)
+                if len(values) != string_count*2 + 3 and len(values) != string_count*2 + 2:
+                    continue
+                columns.append_min(date_time, values)
+            elif file_type == FileType.DAY:
+                if len(values) < 2:
+                    continue
+                columns.append_day(date_time, values)
+            else:
+                logging.error("This filetype is not supported!")
+
+    def get_datapoints_to_influx(self):
+        datapoints = []
+        for columns in self._columns:
+            datapoints += columns.get_datapoints_to_influx(self._last_record_time)
+        return datapoints
+
+    def get_line_protocol(self):
+        return list(batches_to_line_protocol(
+            batch for columns in self._columns for batch in columns.iter_batches(self._last_record_time)))
+
+    def drain_batches(self):
+        """
+        Lazily yields everything parsed so far as PointBatches and forgets it afterwards
+        """
+        for columns in self._columns:
+            yield from columns.iter_batches(self._last_record_time)
+            columns.clear()
+
+    def drain_points(self):
+        """
+        Lazily yields the points of everything parsed so far and forgets them afterwards
+        """
+        return iter_batch_points(self.drain_batches())
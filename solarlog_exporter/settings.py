@@ -10,9 +10,22 @@ TIMEZONE = os.getenv("TIMEZONE", "Europe/Berlin")
 PROJECT_DIR = str(Path(__file__).parent.parent)
 
 # General
+STATE_DIRECTORY = os.getenv("STATE_DIRECTORY", PROJECT_DIR + "/state")
 SOLAR_LOG_NAME = os.getenv("SOLAR_LOG_NAME", "PV-Anlage")
 DIRECTORY = os.getenv("DIRECTORY")
+DIRECTORY_MONITOR_FOR_CHANGES = os.getenv("DIRECTORY_MONITOR_FOR_CHANGES", 'False').lower() in ('true', '1')
 VERBOSE =os.getenv("VERBOSE", 'False').lower() in ('true', '1')
+COLUMNAR_PARSING = os.getenv("COLUMNAR_PARSING", 'False').lower() in ('true', '1')
+EARLY_EXIT = os.getenv("EARLY_EXIT", 'True').lower() in ('true', '1')
+BACKFILL_PROCESSES = int(os.getenv("BACKFILL_PROCESSES", '0'))
+BACKFILL_MIN_FILES = int(os.getenv("BACKFILL_MIN_FILES", '20'))
+PARQUET_EXPORT_DIRECTORY = os.getenv("PARQUET_EXPORT_DIRECTORY")
+CONFIG_CACHE_ON_DISK = os.getenv("CONFIG_CACHE_ON_DISK", 'True').lower() in ('true', '1')
+CONFIG_CACHE_FILE = os.path.join(STATE_DIRECTORY, "config_cache.json")
+HIGH_WATER_MARK = os.getenv("HIGH_WATER_MARK", 'True').lower() in ('true', '1')
+HIGH_WATER_MARK_FILE = os.path.join(STATE_DIRECTORY, "high_water_mark.json")
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", '0'))
 
 # FTP
 FTP_MONITOR_FOR_CHANGES =os.getenv("FTP_MONITOR_FOR_CHANGES", 'False').lower() in ('true', '1')
@@ -20,6 +33,11 @@ FTP_HOST = os.getenv("FTP_HOST")
 FTP_USERNAME = os.getenv("FTP_USERNAME")
 FTP_PASSWORD = os.getenv("FTP_PASSWORD")
 FTP_DIRECTORY = os.getenv("FTP_DIRECTORY")
+FTP_INCREMENTAL_SYNC = os.getenv("FTP_INCREMENTAL_SYNC", 'True').lower() in ('true', '1')
+FTP_STATE_FILE = os.path.join(STATE_DIRECTORY, "ftp_state.json")
+FTP_CONNECTIONS = int(os.getenv("FTP_CONNECTIONS", '2'))
+FTP_POLL_MIN_INTERVAL = float(os.getenv("FTP_POLL_MIN_INTERVAL", '15'))
+FTP_POLL_MAX_INTERVAL = float(os.getenv("FTP_POLL_MAX_INTERVAL", '600'))
 
 # INFLUX
 INFLUXDB_HOST = os.getenv("INFLUXDB_HOST")
@@ -27,3 +45,11 @@ INFLUXDB_PORT = os.getenv("INFLUXDB_PORT", '8086')
 INFLUXDB_BUCKET = os.getenv("INFLUXDB_BUCKET")
 INFLUXDB_ORG = os.getenv("INFLUXDB_ORG")
 INFLUXDB_TOKEN = os.getenv("INFLUXDB_TOKEN")
+INFLUXDB_BATCH_SIZE = int(os.getenv("INFLUXDB_BATCH_SIZE", '10000'))
+INFLUXDB_FLUSH_INTERVAL = float(os.getenv("INFLUXDB_FLUSH_INTERVAL", '1'))
+INFLUXDB_WRITE_QUEUE_SIZE = int(os.getenv("INFLUXDB_WRITE_QUEUE_SIZE", '10'))
+INFLUXDB_WRITE_RETRIES = int(os.getenv("INFLUXDB_WRITE_RETRIES", '5'))
+INFLUXDB_RETRY_INTERVAL = float(os.getenv("INFLUXDB_RETRY_INTERVAL", '1'))
+INFLUXDB_SPOOL = os.getenv("INFLUXDB_SPOOL", 'True').lower() in ('true', '1')
+INFLUXDB_SPOOL_DIRECTORY = os.path.join(STATE_DIRECTORY, "spool")
+INFLUXDB_SPOOL_SEGMENT_SIZE = int(os.getenv("INFLUXDB_SPOOL_SEGMENT_SIZE", '4194304'))
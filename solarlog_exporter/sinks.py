@@ -0,0 +1,243 @@
+import glob
+import logging
+import os
+import time
+import uuid
+from abc import abstractmethod
+
+from solarlog_exporter.file_handler import chunks
+from solarlog_exporter.instrumentation import SERIALIZATION_SECONDS
+from solarlog_exporter.line_protocol import batches_to_line_protocol, to_line_protocol
+from solarlog_exporter.timestamps import local_day
+from solarlog_exporter.utils import iter_batch_points
+
+CHUNK_SIZE = 10000
+
+
+def import_pyarrow():
+    """
+    pyarrow is only loaded for the parquet export, it is an optional dependency
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The parquet export needs pyarrow, install it with: pip install .[parquet]") from e
+    return pyarrow
+
+
+class Sink:
+    """
+    Batched output of the import pipeline. write() takes an iterable of Points, flush() blocks until
+    everything written so far is stored and close() flushes and releases the sink.
+    encode() turns points into the format of the sink and may run in another process (backfill),
+    write_encoded() stores its result. write_batches() and encode_batches() take PointBatches,
+    sinks which do not override them get their points.
+    """
+
+    @staticmethod
+    def encode(points):
+        return points
+
+    @classmethod
+    def encode_batches(cls, batches):
+        return cls.encode(iter_batch_points(batches))
+
+    def write(self, points):
+        self.write_encoded(self.encode(points))
+
+    def write_batches(self, batches):
+        self.write_encoded(self.encode_batches(batches))
+
+    @abstractmethod
+    def write_encoded(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class InfluxSink(Sink):
+    """
+    Line protocol queued in chunks on a BatchWriter
+    """
+
+    def __init__(self, writer, chunk_size=CHUNK_SIZE):
+        self._writer = writer
+        self._chunk_size = chunk_size
+
+    @staticmethod
+    def encode(points):
+        return to_line_protocol(points)
+
+    @staticmethod
+    def encode_batches(batches):
+        return batches_to_line_protocol(batches)
+
+    def write_encoded(self, lines):
+        # the lines are encoded lazily while the chunks are taken, the time queued on the writer is not counted
+        started = time.perf_counter()
+        queued = 0.0
+        influxCount = 0
+        for chunk in chunks(lines, self._chunk_size):
+            queue_started = time.perf_counter()
+            self._writer.write(chunk)
+            queued += time.perf_counter() - queue_started
+            influxCount += 1
+            logging.debug("Datapoint chunks queued for influxdb: %s", influxCount)
+        SERIALIZATION_SECONDS.observe(time.perf_counter() - started - queued)
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+
+class MemorySink(Sink):
+    """
+    Keeps all points in a list, e.g. to run the pipeline offline in tests
+    """
+
+    def __init__(self):
+        self.points = []
+
+    @staticmethod
+    def encode(points):
+        return list(points)
+
+    def write_encoded(self, points):
+        self.points += points
+
+
+class ObservedSink(Sink):
+    """
+    Writes to a sink and lets observers (e.g. the metrics snapshot) see the points on the way.
+    An observer has observe(points), which passes the points on lazily, so nothing is copied.
+    encode() and write_encoded() are the ones of the sink, so the backfill workers keep encoding
+    for it, but what is written encoded is not seen by the observers.
+    """
+
+    def __init__(self, sink, *observers):
+        self.sink = sink
+        self.observers = observers
+        self.encode = sink.encode
+        self.encode_batches = sink.encode_batches
+
+    def write(self, points):
+        self.sink.write(self._observe(points))
+
+    def write_batches(self, batches):
+        for observer in self.observers:
+            batches = observer.observe_batches(batches)
+        self.sink.write_batches(batches)
+
+    def write_encoded(self, data):
+        self.sink.write_encoded(data)
+
+    def show(self, points):
+        """
+        Lets the observers see points without writing them to the sink
+        """
+        for _ in self._observe(points):
+            pass
+
+    def _observe(self, points):
+        for observer in self.observers:
+            points = observer.observe(points)
+        return points
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
+
+
+class ParquetSink(Sink):
+    """
+    Columnar files, partitioned by the local day of the samples as
+    <measurement>/date=YYYY-MM-DD/part-*.parquet. The tags are dictionary encoded and every
+    flush adds one file per partition, flushed automatically after max_rows rows.
+    With overwrite the files already in a partition are removed before the first file of this
+    sink is added to it, so writing the same data again replaces it instead of duplicating it.
+    """
+
+    def __init__(self, directory, max_rows=1000000, overwrite=False):
+        self._pyarrow = import_pyarrow()
+        self._directory = directory
+        self._max_rows = max_rows
+        self._overwrite = overwrite
+        self._partitions = {}
+        self._tag_names = {}
+        self._rows = 0
+        # partitions this sink wrote to
+        self._written = set()
+
+    def write_encoded(self, points):
+        for point in points:
+            key = (point.measurement, local_day(point.epoch))
+            columns = self._partitions.get(key)
+            if columns is None:
+                columns = self._partitions[key] = {"time": []}
+            tag_names = self._tag_names.setdefault(point.measurement, set())
+            tag_names.update(point.tags)
+            rows = len(columns["time"])
+            columns["time"].append(point.epoch)
+            for name, value in (*point.tags.items(), *zip(point.field_names, point.values)):
+                column = columns.get(name)
+                if column is None:
+                    # a column first seen now is empty for the rows before
+                    column = columns[name] = [None] * rows
+                column.append(value)
+            for column in columns.values():
+                if len(column) <= rows:
+                    column.append(None)
+            self._rows += 1
+            if self._rows >= self._max_rows:
+                self.flush()
+
+    def flush(self):
+        for (measurement, day), columns in self._partitions.items():
+            tag_names = self._tag_names[measurement]
+            table = self._pyarrow.table({
+                name: _to_array(self._pyarrow, name, values, name in tag_names) for name, values in columns.items()
+            })
+            directory = os.path.join(self._directory, measurement, "date=" + day)
+            if self._overwrite and (measurement, day) not in self._written:
+                for file_path in glob.glob(os.path.join(directory, "*.parquet")):
+                    os.remove(file_path)
+            self._written.add((measurement, day))
+            os.makedirs(directory, exist_ok=True)
+            file_path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+            self._pyarrow.parquet.write_table(table, file_path)
+            logging.debug("%s rows of %s written to %s", table.num_rows, measurement, file_path)
+        self._partitions = {}
+        self._rows = 0
+
+
+def _to_array(pyarrow, name, values, is_tag):
+    if name == "time":
+        return pyarrow.array(values, pyarrow.timestamp("s", tz="UTC"))
+    if is_tag:
+        return pyarrow.array(values, pyarrow.string()).dictionary_encode()
+    return pyarrow.array(values)
+
+
+def read_parquet(directory, measurement, days=None):
+    """
+    Reads a measurement written by the ParquetSink memory mapped, only the given days ("YYYY-MM-DD") if set
+    """
+    pyarrow = import_pyarrow()
+    tables = []
+    for day_directory in sorted(glob.glob(os.path.join(directory, measurement, "date=*"))):
+        if days is not None and os.path.basename(day_directory)[5:] not in days:
+            continue
+        for file_path in sorted(glob.glob(os.path.join(day_directory, "*.parquet"))):
+            tables.append(pyarrow.parquet.read_table(file_path, memory_map=True))
+    if not tables:
+        return None
+    return pyarrow.concat_tables(tables, promote_options="default")
@@ -0,0 +1,86 @@
+import glob
+import logging
+import os
+import struct
+import zlib
+
+# length and crc32 of the compressed batch
+_HEADER = struct.Struct("<II")
+_SUFFIX = ".spool"
+
+
+class Spool:
+    """
+    Segmented, append-only store of line protocol batches which could not be written to InfluxDB.
+    Every batch is one zlib compressed record with its length and crc32, so a record cut off
+    by a crash is detected and dropped when the segment is read.
+    """
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024):
+        self._directory = directory
+        self._segment_size = segment_size
+        self._file = None
+
+    def _segment_paths(self):
+        return sorted(glob.glob(os.path.join(self._directory, "*" + _SUFFIX)))
+
+    def is_empty(self):
+        return not self._segment_paths()
+
+    def append(self, lines):
+        payload = zlib.compress("\n".join(lines).encode("utf-8"))
+        if self._file is None or self._file.tell() >= self._segment_size:
+            self._open_segment()
+        self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+
+    def sync(self):
+        """
+        Makes everything appended so far durable
+        """
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self.sync()
+            finally:
+                self._file.close()
+                self._file = None
+
+    def _open_segment(self):
+        self.close()
+        os.makedirs(self._directory, exist_ok=True)
+        paths = self._segment_paths()
+        number = int(os.path.basename(paths[-1])[:-len(_SUFFIX)]) + 1 if paths else 1
+        self._file = open(os.path.join(self._directory, f"{number:08d}{_SUFFIX}"), "ab")
+
+    def segments(self):
+        """
+        Paths of all segments, oldest first. The segment open for appending is closed,
+        new batches go to a new segment.
+        """
+        self.close()
+        return self._segment_paths()
+
+    @staticmethod
+    def read(path):
+        """
+        Yields the batches (lists of lines) of a segment up to the first incomplete or broken record
+        """
+        with open(path, "rb") as file:
+            while True:
+                header = file.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                length, crc = _HEADER.unpack(header)
+                payload = file.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    logging.warning("Spool segment %s is broken after %s bytes", path, file.tell())
+                    return
+                yield zlib.decompress(payload).decode("utf-8").split("\n")
+
+    @staticmethod
+    def remove(path):
+        os.remove(path)
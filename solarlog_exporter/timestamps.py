@@ -0,0 +1,124 @@
+import calendar
+from array import array
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import pytz
+
+from solarlog_exporter import settings
+
+_timezone = pytz.timezone(settings.TIMEZONE)
+
+MIN_TIME_CACHE_SIZE = 4096
+DAY_TIME_CACHE_SIZE = 1024
+LOCAL_DAY_SLOT = 900
+
+
+class Timestamp:
+    """
+    SolarLog time converted once and shared by all datapoints of a line,
+    the time string for influxdb is only built when it is used
+    """
+
+    __slots__ = ("date_time", "epoch", "_influxdb")
+
+    def __init__(self, date_time: datetime, epoch: int):
+        self.date_time = date_time
+        self.epoch = epoch
+        self._influxdb = None
+
+    @property
+    def influxdb(self) -> str:
+        if self._influxdb is None:
+            self._influxdb = epoch_to_influxdb(self.epoch)
+        return self._influxdb
+
+
+def _to_timestamp(local_time):
+    date_time = _timezone.localize(local_time)
+    return Timestamp(date_time, int(date_time.timestamp()))
+
+
+@lru_cache(maxsize=MIN_TIME_CACHE_SIZE)
+def parse_min_time(min_time):
+    return _to_timestamp(datetime.strptime(min_time, "%d.%m.%y %H:%M:%S"))
+
+
+@lru_cache(maxsize=DAY_TIME_CACHE_SIZE)
+def parse_day_time(day_time):
+    return _to_timestamp(datetime.strptime(day_time, "%d.%m.%y"))
+
+
+def _day_offset(day_string):
+    """
+    Returns (naive epoch of local midnight, utc offset in seconds or None) for a "dd.mm.yy" string.
+    The offset is None if it changes during the day (DST switch).
+    """
+    day = datetime.strptime(day_string, "%d.%m.%y")
+    start = _timezone.localize(day).utcoffset()
+    end = _timezone.localize(day.replace(hour=23, minute=59, second=59)).utcoffset()
+    midnight = calendar.timegm(day.timetuple())
+    if start != end:
+        return midnight, None
+    return midnight, int(start.total_seconds())
+
+
+def localize_bulk(time_strings):
+    """
+    Converts a column of SolarLog time strings ("dd.mm.yy" or "dd.mm.yy HH:MM:SS") in local time
+    to an array of epoch seconds. Each day is localized only once, per sample localization is only
+    done on days with a DST switch.
+    """
+    epochs = array("q")
+    days = {}
+    for time_string in time_strings:
+        day_string = time_string[:8]
+        day = days.get(day_string)
+        if day is None:
+            day = days[day_string] = _day_offset(day_string)
+        midnight, offset = day
+
+        seconds = 0
+        if len(time_string) > 8:
+            seconds = int(time_string[9:11]) * 3600 + int(time_string[12:14]) * 60 + int(time_string[15:17])
+
+        if offset is None:
+            local = datetime.strptime(time_string, "%d.%m.%y %H:%M:%S")
+            epochs.append(int(_timezone.localize(local).timestamp()))
+        else:
+            epochs.append(midnight + seconds - offset)
+    return epochs
+
+
+def epoch_to_influxdb(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@lru_cache(maxsize=DAY_TIME_CACHE_SIZE)
+def _local_day(slot):
+    return datetime.fromtimestamp(slot * LOCAL_DAY_SLOT, _timezone).date().isoformat()
+
+
+def local_day(epoch):
+    """
+    Local day ("YYYY-MM-DD") of epoch seconds, converted once per 15 minutes
+    (every timezone offset is a multiple of it)
+    """
+    return _local_day(epoch // LOCAL_DAY_SLOT)
+
+
+def to_sortable(time_string):
+    """
+    "dd.mm.yy HH:MM:SS" -> "yymmddHHMMSS" and "dd.mm.yy" -> "yymmdd", comparable as strings
+    """
+    return time_string[6:8] + time_string[3:5] + time_string[0:2] + \
+        time_string[9:11] + time_string[12:14] + time_string[15:17]
+
+
+def to_local_sortable(date_time):
+    """
+    Sortable local time string of a datetime (naive datetimes are taken as local time)
+    """
+    if date_time.tzinfo is not None:
+        date_time = date_time.astimezone(_timezone)
+    return date_time.strftime("%y%m%d%H%M%S")
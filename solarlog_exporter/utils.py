@@ -1,12 +1,11 @@
-from operator import itemgetter
 import re
 from abc import abstractmethod
+from array import array
 from datetime import datetime
-from typing import Optional
+from typing import NamedTuple, Optional, Sequence
 
-import pytz as pytz
-
-from solarlog_exporter import settings
+from solarlog_exporter.line_protocol import format_tags, line_format
+from solarlog_exporter.timestamps import Timestamp, epoch_to_influxdb, localize_bulk, parse_day_time, parse_min_time
 
 
 class FileType:
@@ -30,6 +29,24 @@ class FileType:
             return None
 
 
+class Point(NamedTuple):
+    """
+    Sample handed to the sinks. The tags are shared by all points of an inverter (and string)
+    and must not be changed. The values are in the order of field_names, a tuple shared by all
+    points of a measurement.
+    """
+
+    measurement: str
+    tags: dict
+    field_names: tuple
+    values: tuple
+    epoch: int
+
+    @property
+    def fields(self):
+        return dict(zip(self.field_names, self.values))
+
+
 class Inverter:
     """
     Inverter Object
@@ -55,17 +72,54 @@ class Inverter:
             self.group = inverter_config[1]
         else:
             self.group = 'nogroup'
+        self._line_protocol_prefixes = {}
+        self._tags = {}
+
+    def get_tags(self, string=None):
+        """
+        Tags of this inverter (and string), one shared dict per string
+        """
+        tags = self._tags.get(string)
+        if tags is None:
+            tags = self._tags[string] = {"inverter": self.name, "system": self.system, "group": self.group}
+            if string is not None:
+                tags["string"] = string
+        return tags
+
+    def get_line_protocol_prefix(self, measurement, string=None):
+        """
+        Escaped measurement and tags of this inverter, built once per measurement and string
+        """
+        key = (measurement, string)
+        prefix = self._line_protocol_prefixes.get(key)
+        if prefix is None:
+            tags = {"inverter": self.name, "system": self.system, "group": self.group}
+            if string is not None:
+                tags["string"] = string
+            prefix = self._line_protocol_prefixes[key] = format_tags(measurement, tags)
+        return prefix
 
     def add_datapoint(self, datapoint, last_record_time):
         if datapoint.date_time.date() < last_record_time.date():
             return
 
+        # keyed by epoch seconds, a later datapoint with the same time replaces the earlier one
         if datapoint.type == FileType.MIN:
-            self.datapoints_min[datapoint.get_date_time_as_timestring()] = datapoint
+            self.datapoints_min[datapoint.timestamp.epoch] = datapoint
         if datapoint.type == FileType.MIN_STR:
-            self.datapoints_string[datapoint.name][datapoint.get_date_time_as_timestring()] = datapoint
+            self.datapoints_string[datapoint.name][datapoint.timestamp.epoch] = datapoint
         elif datapoint.type == FileType.DAY:
-            self.datapoints_day[datapoint.get_date_time_as_datestring()] = datapoint
+            self.datapoints_day[datapoint.timestamp.epoch] = datapoint
+
+    @staticmethod
+    def get_datapoints_between(datapoints, start=None, end=None):
+        """
+        Datapoints of one store (e.g. datapoints_min) with start <= epoch < end, sorted by time
+        """
+        return [
+            datapoints[epoch] for epoch in sorted(datapoints)
+            if (start is None or epoch >= start) and (end is None or epoch < end)
+        ]
 
     def get_datapoints_to_influx(self):
         influx_datapoints = []
@@ -82,6 +136,37 @@ class Inverter:
 
         return influx_datapoints
 
+    def get_line_protocol(self):
+        return list(self.iter_line_protocol())
+
+    def iter_line_protocol(self):
+        for value in self.datapoints_min.values():
+            yield value.get_line_protocol(self)
+
+        for value in self.datapoints_string.values():
+            for v in value.values():
+                yield v.get_line_protocol(self)
+
+        for value in self.datapoints_day.values():
+            yield value.get_line_protocol(self)
+
+    def iter_points(self):
+        for value in self.datapoints_min.values():
+            yield value.get_point(self)
+
+        for value in self.datapoints_string.values():
+            for v in value.values():
+                yield v.get_point(self)
+
+        for value in self.datapoints_day.values():
+            yield value.get_point(self)
+
+    def clear_datapoints(self):
+        self.datapoints_min.clear()
+        for value in self.datapoints_string.values():
+            value.clear()
+        self.datapoints_day.clear()
+
 
 
 class InverterList:
@@ -117,14 +202,162 @@ class InverterList:
 
         return datapoints
 
+    def get_inverter_line_protocol(self):
+        lines = []
+
+        for inverter in self.inverters:
+            lines += inverter.get_line_protocol()
+
+        return lines
+
+    def drain_inverter_points(self):
+        """
+        Yields the points inverter by inverter and removes the datapoints once they are read
+        """
+        for inverter in self.inverters:
+            yield from inverter.iter_points()
+            inverter.clear_datapoints()
+
+
+class PointBatch(NamedTuple):
+    """
+    Samples of one measurement and tags dict as columns: the epochs and one value column per field
+    name. Sinks which take the columns as they are (e.g. line protocol) build no Point per sample.
+    """
+
+    measurement: str
+    tags: dict
+    field_names: tuple
+    epochs: Sequence
+    columns: tuple
+
+    def points(self):
+        for epoch, values in zip(self.epochs, zip(*self.columns)):
+            yield Point(self.measurement, self.tags, self.field_names, values, epoch)
+
+
+def iter_batch_points(batches):
+    """
+    Lazily yields the points of PointBatches
+    """
+    for batch in batches:
+        yield from batch.points()
+
+
+class InverterColumns:
+    """
+    Columnar storage of the samples of one inverter (used by the ColumnarDataParser)
+    """
+
+    def __init__(self, inverter):
+        self.inverter = inverter
+        self.string_names = list(inverter.datapoints_string.keys())
+        self.clear()
+
+    def append_min(self, date_time, values):
+        string_count = len(self.string_names)
+        self.min_time.append(date_time)
+        self.pac.append(_to_float(values[0]))
+        self.eday.append(_to_float(values[string_count + 1]))
+        temperature = values[(string_count * 2) + 2] if len(values) > (string_count * 2) + 2 else 0
+        self.temperature.append(0 if not temperature else int(temperature))
+        for index in range(string_count):
+            self.pdc[index].append(_to_float(values[1 + index]))
+            self.udc[index].append(_to_float(values[string_count + 2 + index]))
+
+    def append_day(self, date_time, values):
+        self.day_time.append(date_time)
+        self.day_eday.append(_to_float(values[0]))
+        self.day_pac_max.append(_to_float(values[1]))
+
+    @staticmethod
+    def _select_rows(time_column, last_record_time):
+        """
+        Converts the time column in bulk and returns (epochs, rows to export or None for all rows).
+        Rows are only picked one by one if there are days before the last record or duplicated
+        timestamps, later rows win for these like in Inverter.add_datapoint.
+        """
+        epochs = localize_bulk(time_column)
+        last_record_date = last_record_time.date()
+        old_days = {
+            day for day in {time_string[:8] for time_string in time_column}
+            if datetime.strptime(day, "%d.%m.%y").date() < last_record_date
+        }
+        if not old_days and len(set(epochs)) == len(epochs):
+            return epochs, None
+
+        rows = {}
+        for row, epoch in enumerate(epochs):
+            if time_column[row][:8] not in old_days:
+                rows[epoch] = row
+        return array("q", rows), list(rows.values())
+
+    @staticmethod
+    def _take(column, rows):
+        return column if rows is None else [column[row] for row in rows]
+
+    def iter_batches(self, last_record_time):
+        """
+        Lazily yields the samples to export as PointBatches, the columns are taken as they are
+        """
+        inverter = self.inverter
+        take = self._take
+
+        epochs, rows = self._select_rows(self.min_time, last_record_time)
+        if epochs:
+            yield PointBatch(MinDatapoint.influx_measurment_name, inverter.get_tags(), MinDatapoint.field_names,
+                             epochs, (take(self.pac, rows), take(self.eday, rows), take(self.temperature, rows)))
+            for index, name in enumerate(self.string_names):
+                yield PointBatch(StringDatapoint.influx_measurment_name, inverter.get_tags(name),
+                                 StringDatapoint.field_names, epochs,
+                                 (take(self.pdc[index], rows), take(self.udc[index], rows)))
+
+        epochs, rows = self._select_rows(self.day_time, last_record_time)
+        if epochs:
+            yield PointBatch(DayDatapoint.influx_measurment_name, inverter.get_tags(), DayDatapoint.field_names,
+                             epochs, (take(self.day_eday, rows), take(self.day_pac_max, rows)))
+
+    def get_datapoints_to_influx(self, last_record_time):
+        return [
+            {
+                "measurement": point.measurement,
+                "tags": dict(point.tags),
+                "time": epoch_to_influxdb(point.epoch),
+                "fields": point.fields,
+            }
+            for point in iter_batch_points(self.iter_batches(last_record_time))
+        ]
+
+    def clear(self):
+        """
+        Forgets all samples. New columns are created, batches handed out before keep theirs.
+        """
+        self.min_time = []
+        self.pac = array("d")
+        self.eday = array("d")
+        self.temperature = array("q")
+        self.pdc = [array("d") for _ in self.string_names]
+        self.udc = [array("d") for _ in self.string_names]
+
+        self.day_time = []
+        self.day_eday = array("d")
+        self.day_pac_max = array("d")
+
+
+def _to_float(value):
+    return float(0) if not value else float(value)
+
 
 class Datapoint:
     """
-    Basic Datapoint
+    Basic Datapoint, slots keep the millions of samples of a backfill small
     """
 
-    _timezone = pytz.timezone(settings.TIMEZONE)
-    date_time = datetime.now()
+    __slots__ = ("timestamp",)
+
+    @property
+    def date_time(self):
+        return self.timestamp.date_time
 
     def __eq__(self, other):
         return self.__class__ == other.__class__ and self.date_time == other.date_time
@@ -133,6 +366,14 @@ class Datapoint:
     def get_datapoint_to_influx(self, inverter):
         pass
 
+    @abstractmethod
+    def get_line_protocol(self, inverter):
+        pass
+
+    @abstractmethod
+    def get_point(self, inverter):
+        pass
+
     def get_date_time_as_timestring(self):
         return self.date_time.strftime("%d.%m.%y %H:%M:%S")
 
@@ -140,7 +381,13 @@ class Datapoint:
         return self.date_time.date().strftime("%d.%m.%y")
 
     def get_date_time_for_influxdb(self):
-        return self.date_time.astimezone(pytz.utc).isoformat().replace("+00:00", "Z")
+        return self.timestamp.influxdb
+
+    def _set_timestamp(self, value, parse):
+        """
+        Accepts a SolarLog time string or an already converted Timestamp (shared per line)
+        """
+        self.timestamp = value if isinstance(value, Timestamp) else parse(value)
 
 
 class MinDatapoint(Datapoint):
@@ -148,13 +395,14 @@ class MinDatapoint(Datapoint):
     Minute Datapoint (min_xxxx.js)
     """
 
+    __slots__ = ("pac", "eday", "temperature")
     influx_measurment_name = "solarlog_min"
+    field_names = ("Pac", "Eday", "temperature")
+    line_format = line_format(field_names)
     type = FileType.MIN
 
     def __init__(self, min_time, pac, eday, temperature):
-        self.date_time = self._timezone.localize(
-            datetime.strptime(min_time, "%d.%m.%y %H:%M:%S")
-        )
+        self._set_timestamp(min_time, parse_min_time)
         self.pac = float(0) if not pac else float(pac)
         self.eday = float(0) if not eday else float(eday)
         self.temperature = 0 if not temperature else int(temperature)
@@ -175,19 +423,36 @@ class MinDatapoint(Datapoint):
             },
         }
 
+    def get_line_protocol(self, inverter):
+        return self.line_format.format(
+            inverter.get_line_protocol_prefix(self.influx_measurment_name),
+            (self.pac, self.eday, self.temperature),
+            self.timestamp.epoch
+        )
+
+    def get_point(self, inverter):
+        return Point(
+            self.influx_measurment_name,
+            inverter.get_tags(),
+            self.field_names,
+            (self.pac, self.eday, self.temperature),
+            self.timestamp.epoch
+        )
+
 
 class DayDatapoint(Datapoint):
     """
     Day Datapoint (days.js, days_hist.js)
     """
 
+    __slots__ = ("eday", "pac_max")
     influx_measurment_name = "solarlog_day"
+    field_names = ("Eday", "PacMax")
+    line_format = line_format(field_names)
     type = FileType.DAY
 
     def __init__(self, day_time, eday, pac_max):
-        self.date_time = self._timezone.localize(
-            datetime.strptime(day_time, "%d.%m.%y")
-        )
+        self._set_timestamp(day_time, parse_day_time)
         self.eday = float(0) if not eday else float(eday)
         self.pac_max = float(0) if not pac_max else float(pac_max)
 
@@ -203,18 +468,35 @@ class DayDatapoint(Datapoint):
             "fields": {"Eday": self.eday, "PacMax": self.pac_max},
         }
 
+    def get_line_protocol(self, inverter):
+        return self.line_format.format(
+            inverter.get_line_protocol_prefix(self.influx_measurment_name),
+            (self.eday, self.pac_max),
+            self.timestamp.epoch
+        )
+
+    def get_point(self, inverter):
+        return Point(
+            self.influx_measurment_name,
+            inverter.get_tags(),
+            self.field_names,
+            (self.eday, self.pac_max),
+            self.timestamp.epoch
+        )
+
 class StringDatapoint(Datapoint):
     """
     String Datapoint (String data from min_xxxx.js)
     """
 
+    __slots__ = ("pdc", "udc", "name")
     influx_measurment_name = "solarlog_min_strings"
+    field_names = ("Pdc", "Udc")
+    line_format = line_format(field_names)
     type = FileType.MIN_STR
 
     def __init__(self, min_time, name, pdc, udc):
-        self.date_time = self._timezone.localize(
-            datetime.strptime(min_time, "%d.%m.%y %H:%M:%S")
-        )
+        self._set_timestamp(min_time, parse_min_time)
         self.pdc = float(0) if not pdc else float(pdc)
         self.udc = float(0) if not udc else float(udc)
         self.name = name
@@ -233,4 +515,20 @@ class StringDatapoint(Datapoint):
                 "Pdc": self.pdc,
                 "Udc": self.udc,
             },
-        }
\ No newline at end of file
+        }
+
+    def get_line_protocol(self, inverter):
+        return self.line_format.format(
+            inverter.get_line_protocol_prefix(self.influx_measurment_name, self.name),
+            (self.pdc, self.udc),
+            self.timestamp.epoch
+        )
+
+    def get_point(self, inverter):
+        return Point(
+            self.influx_measurment_name,
+            inverter.get_tags(self.name),
+            self.field_names,
+            (self.pdc, self.udc),
+            self.timestamp.epoch
+        )
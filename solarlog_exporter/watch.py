@@ -0,0 +1,87 @@
+import logging
+import os
+import queue
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """
+    Puts the path of every created, modified or moved .js file into a queue
+    """
+
+    def __init__(self, changes):
+        self._changes = changes
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ("created", "modified", "moved", "closed"):
+            return
+        path = getattr(event, "dest_path", None) or event.src_path
+        if path.endswith(".js"):
+            self._changes.put(os.path.basename(path))
+
+
+class DirectoryWatcher:
+    """
+    Collects the files changed in a local Solar-Log directory with watchdog.
+    A file is often written in several steps, so changes are handed out once the
+    directory was quiet for settle seconds.
+    """
+
+    def __init__(self, path, settle=2.0):
+        self._changes = queue.Queue()
+        self._settle = settle
+        self._observer = Observer()
+        self._observer.schedule(_ChangeHandler(self._changes), path, recursive=False)
+
+    def start(self):
+        self._observer.start()
+        logging.debug("Watching directory for changes")
+
+    def stop(self):
+        self._observer.stop()
+        self._observer.join()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until files changed or the timeout passed and returns the names of the changed files
+        """
+        changed = set()
+        try:
+            changed.add(self._changes.get(timeout=timeout))
+        except queue.Empty:
+            return changed
+        while True:
+            try:
+                changed.add(self._changes.get(timeout=self._settle))
+            except queue.Empty:
+                return changed
+
+
+class AdaptivePoll:
+    """
+    Poll interval driven by the modification time of a file (min_day.js): short while the
+    file changes, growing by half for every poll without a change up to max_interval (nights)
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self._min_interval = min_interval
+        self._max_interval = max(min_interval, max_interval)
+        self._mdtm = None
+        self.interval = min_interval
+
+    def changed(self, mdtm):
+        """
+        Returns True if the file changed since the last poll and adapts the interval.
+        Without a modification time every poll counts as a change at the maximal interval.
+        """
+        if mdtm is None:
+            self.interval = self._max_interval
+            return True
+        if mdtm != self._mdtm:
+            self._mdtm = mdtm
+            self.interval = self._min_interval
+            return True
+        self.interval = min(self.interval * 1.5, self._max_interval)
+        return False
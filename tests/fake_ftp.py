@@ -0,0 +1,71 @@
+import os
+
+
+class FakeConnection:
+    def __init__(self, ftp, data):
+        self._ftp = ftp
+        self._data = data
+
+    def recv(self, size):
+        block, self._data = self._data[:size], self._data[size:]
+        self._ftp.transferred += len(block)
+        return block
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeFtp:
+    """
+    Serves content for every transfer, counting the downloads and the transferred bytes
+    """
+    encoding = "utf-8"
+
+    def __init__(self, content):
+        self.content = content
+        self.transferred = 0
+        self.downloads = 0
+
+    def voidcmd(self, cmd):
+        return "200 OK"
+
+    def voidresp(self):
+        return "226 Transfer complete"
+
+    def transfercmd(self, cmd, rest=None):
+        self.downloads += 1
+        return FakeConnection(self, self.content[rest or 0:])
+
+
+class FakeFtpDirectory(FakeFtp):
+    """
+    Serves the files of a local directory, listed with MLSD
+    """
+
+    def __init__(self, directory):
+        super().__init__(b"")
+        self._directory = directory
+
+    def mlsd(self, path, facts=()):
+        for name in sorted(os.listdir(self._directory)):
+            yield name, {"type": "file", "size": str(os.path.getsize(os.path.join(self._directory, name)))}
+
+    def transfercmd(self, cmd, rest=None):
+        self.downloads += 1
+        with open(os.path.join(self._directory, os.path.basename(cmd[len("RETR "):])), "rb") as file:
+            return FakeConnection(self, file.read()[rest or 0:])
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
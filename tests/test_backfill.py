@@ -0,0 +1,34 @@
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from solarlog_exporter.backfill import get_processes, parse_files
+from solarlog_exporter.parser import ColumnarDataParser, ConfigParser
+from solarlog_exporter.sinks import InfluxSink
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestBackfill(TestCase):
+    def setUp(self):
+        config_parser = ConfigParser()
+        config_parser.parse_file(TEST_DIR + "/pdc_test/base_vars.js")
+        self._inverters = config_parser.get_inverters()
+        self._last_record_time = datetime.strptime("01.03.2021", "%d.%m.%Y")
+        self._files = [TEST_DIR + "/pdc_test/min230721.js", TEST_DIR + "/pdc_test/days_hist.js"]
+
+    def test_same_lines_as_single_process(self):
+        expected = []
+        for file_path in self._files:
+            data_parser = ColumnarDataParser(self._inverters, self._last_record_time)
+            data_parser.parse_file(file_path)
+            expected.append((file_path, data_parser.get_line_protocol(), data_parser.cutoff.newest))
+
+        result = [(file_path, lines, cutoff.newest) for file_path, lines, cutoff
+                  in parse_files(self._files, self._inverters, self._last_record_time, 2, InfluxSink.encode_batches)]
+
+        self.assertEqual(result, expected)
+
+    def test_get_processes(self):
+        self.assertEqual(get_processes(3), 3)
+        self.assertGreaterEqual(get_processes(0), 1)
@@ -0,0 +1,134 @@
+import os
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from solarlog_exporter import core, ftp_sync, settings
+from solarlog_exporter.file_handler import DEFAULT_LAST_RECORD_TIME
+from solarlog_exporter.instrumentation import LINES
+from solarlog_exporter.metrics import SnapshotSink
+from solarlog_exporter.parser import ConfigCache, ConfigParser, DataParser
+from solarlog_exporter.sinks import InfluxSink, ObservedSink
+from tests.fake_ftp import FakeFtpDirectory
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeQueryApi:
+    def query(self, query):
+        return []
+
+
+class FakeInflux:
+    bucket = "solarlog"
+
+    def __init__(self):
+        self.lines = []
+
+    def query_api(self):
+        return FakeQueryApi()
+
+    def write_lines(self, lines):
+        self.lines += lines
+
+
+@patch.object(core, "HIGH_WATER_MARK", None)
+@patch.object(core, "SPOOL", None)
+@patch.object(core, "SNAPSHOT", None)
+@patch.object(core, "CONFIG_CACHE", ConfigCache())
+class TestStartImport(TestCase):
+    def _expected_lines(self, last_record_time):
+        config_parser = ConfigParser()
+        config_parser.parse_file(TEST_DIR + "/pdc_test/base_vars.js")
+        data_parser = DataParser(config_parser.get_inverters(), last_record_time)
+        for file in core.getImportFiles(TEST_DIR + "/pdc_test", last_record_time):
+            data_parser.parse_file(TEST_DIR + "/pdc_test/" + file)
+        return data_parser.get_line_protocol()
+
+    def test_all_lines_are_written(self):
+        influx = FakeInflux()
+
+        core.start_import(TEST_DIR + "/pdc_test", influx)
+
+        expected = self._expected_lines(DEFAULT_LAST_RECORD_TIME)
+        self.assertTrue(expected)
+        self.assertEqual(sorted(influx.lines), sorted(expected))
+
+    def test_small_import_without_pool(self):
+        influx = FakeInflux()
+
+        with patch.object(settings, "BACKFILL_PROCESSES", 4), patch.object(core, "parse_files") as parse_files:
+            core.start_import(TEST_DIR + "/pdc_test", influx)
+
+        parse_files.assert_not_called()
+        self.assertEqual(sorted(influx.lines), sorted(self._expected_lines(DEFAULT_LAST_RECORD_TIME)))
+
+    def test_lines_of_failed_import_are_counted(self):
+        lines = LINES.value()
+
+        with patch.object(core, "writeDataToSink", side_effect=OSError("disk full")), self.assertRaises(OSError):
+            core.start_import(TEST_DIR + "/pdc_test", FakeInflux())
+
+        self.assertGreater(LINES.value(), lines)
+
+    def test_write_data_to_sink(self):
+        influx = FakeInflux()
+        last_record_time = datetime.strptime("01.03.2021", "%d.%m.%Y")
+        config_parser = ConfigParser()
+        config_parser.parse_file(TEST_DIR + "/pdc_test/base_vars.js")
+        data_parser = DataParser(config_parser.get_inverters(), last_record_time)
+        data_parser.parse_file(TEST_DIR + "/pdc_test/min230721.js")
+        expected = data_parser.get_line_protocol()
+
+        sink = core.createSink(influx)
+        core.writeDataToSink(data_parser, sink)
+        sink.close()
+
+        self.assertEqual(influx.lines, expected)
+        # the parser is drained, nothing is written twice
+        self.assertEqual(data_parser.get_line_protocol(), [])
+
+    def test_snapshot_is_fed(self):
+        expected = self._expected_lines(DEFAULT_LAST_RECORD_TIME)
+        for processes in (1, 2):
+            with self.subTest(processes=processes), patch.object(settings, "BACKFILL_PROCESSES", processes), \
+                    patch.object(settings, "BACKFILL_MIN_FILES", 2):
+                influx = FakeInflux()
+                snapshot = SnapshotSink()
+                with patch.object(core, "SNAPSHOT", snapshot):
+                    sink = core.createSink(influx)
+                    # the backfill workers still encode line protocol for the influxdb sink
+                    self.assertIsInstance(sink, ObservedSink)
+                    self.assertIs(sink.encode, InfluxSink.encode)
+                    self.assertIs(sink.encode_batches, InfluxSink.encode_batches)
+                    sink.close()
+
+                    core.start_import(TEST_DIR + "/pdc_test", influx)
+
+                self.assertEqual(sorted(influx.lines), sorted(expected))
+                pac_lines = [line for line in snapshot.render().decode("utf-8").splitlines()
+                             if line.startswith("solarlog_pac_watts{")]
+                self.assertEqual(len(pac_lines), 11)
+
+    def test_ftp_import(self):
+        expected = self._expected_lines(DEFAULT_LAST_RECORD_TIME)
+        for connections in (1, 2):
+            with self.subTest(connections=connections), patch.object(settings, "FTP_HOST", "solarlog"), \
+                    patch.object(settings, "FTP_INCREMENTAL_SYNC", False), \
+                    patch.object(settings, "FTP_CONNECTIONS", connections):
+                servers = []
+
+                def connect(host, user, passwd):
+                    servers.append(FakeFtpDirectory(TEST_DIR + "/pdc_test"))
+                    return servers[-1]
+
+                influx = FakeInflux()
+                lines = LINES.value()
+                with patch.object(core, "connect", connect), patch.object(ftp_sync, "connect", connect):
+                    core.start_ftp_import("/", influx)
+
+                # pooled connections parse the files while they arrive as well
+                self.assertEqual(len(servers), connections)
+                self.assertTrue(all(server.downloads for server in servers))
+                self.assertEqual(sorted(influx.lines), sorted(expected))
+                self.assertGreater(LINES.value(), lines)
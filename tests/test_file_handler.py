@@ -1,6 +1,12 @@
-from datetime import datetime
+import os
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
 from unittest import TestCase
-from solarlog_exporter.file_handler import is_import_day_file, is_import_min_file
+from unittest.mock import MagicMock
+
+from solarlog_exporter.file_handler import (DEFAULT_LAST_RECORD_TIME, HighWaterMark, chunks, get_last_record_time,
+                                            get_last_record_time_influxdb, is_import_day_file, is_import_min_file)
 
 
 class TestFileHandler(TestCase):
@@ -18,6 +24,60 @@ class TestFileHandler(TestCase):
         self.assertFalse(is_import_min_file("min_200101.js", self._last_record_time))
         self.assertFalse(is_import_min_file("months.js", self._last_record_time))
 
-    # todo: add test
     def test_get_last_record_time_influxdb(self):
-        pass
+        query_api = MagicMock()
+        newest = datetime(2021, 3, 1, 12, 5, tzinfo=timezone.utc)
+        older = datetime(2021, 3, 1, 12, 0, tzinfo=timezone.utc)
+        tables = [SimpleNamespace(records=[SimpleNamespace(values={"_time": older})]),
+                  SimpleNamespace(records=[SimpleNamespace(values={"_time": newest})])]
+        query_api.query.side_effect = [[], [], tables]
+
+        self.assertEqual(get_last_record_time_influxdb(query_api, "solarlog"), newest)
+        # the range was widened twice
+        self.assertEqual(query_api.query.call_count, 3)
+        self.assertIn("range(start: -31d)", query_api.query.call_args[0][0])
+
+    def test_get_last_record_time_influxdb_empty(self):
+        query_api = MagicMock()
+        query_api.query.return_value = []
+
+        self.assertEqual(get_last_record_time_influxdb(query_api, "solarlog"), DEFAULT_LAST_RECORD_TIME)
+        self.assertIn("range(start: 0)", query_api.query.call_args[0][0])
+
+    def test_high_water_mark(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "state", "high_water_mark.json")
+            query_api = MagicMock()
+            high_water_mark = HighWaterMark(file_path, "solarlog", "PV-Anlage")
+            time = datetime(2021, 3, 1, 12, 5, tzinfo=timezone.utc)
+
+            high_water_mark.update(time)
+            high_water_mark.update(datetime(2021, 3, 1, 12, 0, tzinfo=timezone.utc))
+
+            loaded = HighWaterMark(file_path, "solarlog", "PV-Anlage")
+            query_api.query.return_value = [SimpleNamespace(records=[SimpleNamespace(values={"_time": time})])]
+            self.assertEqual(get_last_record_time(query_api, "solarlog", loaded), time)
+            # checked once with a query bounded to the day before the mark, then influxdb is not asked again
+            self.assertIn("range(start: 2021-02-28T12:05:00Z)", query_api.query.call_args[0][0])
+            self.assertEqual(get_last_record_time(query_api, "solarlog", loaded), time)
+            self.assertEqual(query_api.query.call_count, 1)
+            self.assertIsNone(HighWaterMark(file_path, "other", "PV-Anlage").get())
+
+    def test_high_water_mark_of_empty_bucket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "high_water_mark.json")
+            HighWaterMark(file_path, "solarlog", "PV-Anlage").update(datetime(2021, 3, 1, 12, 5, tzinfo=timezone.utc))
+            query_api = MagicMock()
+            query_api.query.return_value = []
+
+            high_water_mark = HighWaterMark(file_path, "solarlog", "PV-Anlage")
+            self.assertEqual(get_last_record_time(query_api, "solarlog", high_water_mark), DEFAULT_LAST_RECORD_TIME)
+
+            # the mark is dropped, also on disk
+            self.assertIsNone(high_water_mark.get())
+            self.assertIsNone(HighWaterMark(file_path, "solarlog", "PV-Anlage").get())
+
+    def test_chunks(self):
+        self.assertEqual(list(chunks([1, 2, 3, 4, 5], 2)), [[1, 2], [3, 4], [5]])
+        self.assertEqual(list(chunks((i for i in range(3)), 5)), [[0, 1, 2]])
+        self.assertEqual(list(chunks([], 5)), [])
@@ -0,0 +1,223 @@
+import os
+import tempfile
+import time
+from ftplib import error_perm
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from solarlog_exporter.ftp_sync import (FtpConnectionPool, FtpSession, FtpStateIndex, StopTransfer, fetch_in_order,
+                                        fetch_new_data, get_remote_stat, list_remote_files)
+from tests.fake_ftp import FakeFtp
+
+
+class TestFtpStateIndex(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._file_path = os.path.join(self._directory.name, "state", "ftp_state.json")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_is_unchanged(self):
+        state_index = FtpStateIndex(self._file_path)
+        self.assertFalse(state_index.is_unchanged("min230721.js", (100, "20230721235500")))
+
+        state_index.update("min230721.js", (100, "20230721235500"))
+
+        self.assertTrue(state_index.is_unchanged("min230721.js", (100, "20230721235500")))
+        self.assertFalse(state_index.is_unchanged("min230721.js", (120, "20230721235500")))
+        self.assertFalse(state_index.is_unchanged("min230721.js", (100, "20230722000500")))
+        self.assertFalse(state_index.is_unchanged("min230721.js", None))
+
+    def test_save_and_load(self):
+        state_index = FtpStateIndex(self._file_path)
+        state_index.update("days.js", (42, "20230721235500"))
+        state_index.save()
+
+        self.assertEqual(FtpStateIndex(self._file_path).get("days.js"),
+                         {"size": 42, "mdtm": "20230721235500", "offset": 42})
+
+    def test_broken_file(self):
+        os.makedirs(os.path.dirname(self._file_path))
+        with open(self._file_path, "w") as file:
+            file.write("{broken")
+
+        self.assertIsNone(FtpStateIndex(self._file_path).get("days.js"))
+
+
+class TestRemoteFiles(TestCase):
+    def test_list_remote_files(self):
+        ftp = MagicMock()
+        ftp.mlsd.return_value = [
+            ("min230721.js", {"type": "file", "size": "1234", "modify": "20230721235500"}),
+            ("backup", {"type": "dir", "modify": "20230721235500"}),
+        ]
+
+        self.assertEqual(list_remote_files(ftp, "/"), {"min230721.js": (1234, "20230721235500")})
+
+    def test_list_remote_files_without_mlsd(self):
+        ftp = MagicMock()
+        ftp.mlsd.side_effect = error_perm("500 Unknown command")
+
+        self.assertIsNone(list_remote_files(ftp, "/"))
+
+    def test_get_remote_stat(self):
+        ftp = MagicMock()
+        ftp.size.return_value = 1234
+        ftp.voidcmd.side_effect = ["200 Type set to I", "213 20230721235500"]
+
+        self.assertEqual(get_remote_stat(ftp, "/min230721.js"), (1234, "20230721235500"))
+
+
+class TestFetchNewData(TestCase):
+    def setUp(self):
+        self._old = b"".join(b'm[mi++]="02.03.21 21:%02d:00|0;0;34787;0;21"\n' % minute for minute in range(50, 0, -5))
+
+    def _stat(self, content):
+        return len(content), "20210302220000"
+
+    def test_full_fetch(self):
+        data, state = fetch_new_data(FakeFtp(self._old), "/min_day.js", None, self._stat(self._old))
+
+        self.assertEqual(data, self._old)
+        self.assertEqual(state["offset"], len(self._old))
+
+    def test_stopped_by_callback(self):
+        content = self._old * 100
+        ftp = FakeFtp(content)
+
+        def callback(block):
+            raise StopTransfer()
+
+        data, state = fetch_new_data(ftp, "/min_day.js", None, self._stat(content), callback=callback)
+
+        self.assertIsNone(data)
+        self.assertLess(ftp.transferred, len(content))
+        # the unread rest counts as consumed, only a prepend can be detected next time
+        self.assertEqual(state["offset"], len(content))
+        self.assertEqual(state["tail_size"], 0)
+
+        ftp = FakeFtp(b"new\n" + content)
+        data, _ = fetch_new_data(ftp, "/min_day.js", state, self._stat(ftp.content))
+        self.assertEqual(data, b"new\n")
+
+    def test_prepended(self):
+        _, entry = fetch_new_data(FakeFtp(self._old), "/min_day.js", None, self._stat(self._old))
+        new_lines = b'm[mi++]="02.03.21 21:55:00|0;0;34787;0;21"\n'
+        ftp = FakeFtp(new_lines + self._old)
+
+        data, state = fetch_new_data(ftp, "/min_day.js", entry, self._stat(ftp.content))
+
+        self.assertEqual(data, new_lines)
+        self.assertEqual(state["offset"], len(ftp.content))
+        self.assertLess(ftp.transferred, len(ftp.content))
+
+        # the next prepend is detected with the new state as well
+        newer_lines = b'm[mi++]="02.03.21 22:00:00|0;0;34787;0;21"\n'
+        ftp = FakeFtp(newer_lines + ftp.content)
+        data, _ = fetch_new_data(ftp, "/min_day.js", state, self._stat(ftp.content))
+        self.assertEqual(data, newer_lines)
+
+    def test_appended(self):
+        _, entry = fetch_new_data(FakeFtp(self._old), "/days_hist.js", None, self._stat(self._old))
+        new_lines = b'm[mi++]="02.03.21 20:55:00|0;0;34787;0;21"\n'
+        ftp = FakeFtp(self._old + new_lines)
+
+        data, state = fetch_new_data(ftp, "/days_hist.js", entry, self._stat(ftp.content))
+
+        self.assertEqual(data, new_lines)
+        self.assertEqual(state["offset"], len(ftp.content))
+
+    def test_appended_partial_line(self):
+        _, entry = fetch_new_data(FakeFtp(self._old), "/days_hist.js", None, self._stat(self._old))
+        new_line = b'm[mi++]="02.03.21 20:55:00|0;0;34787;0;21"\n'
+        partial_line = b'm[mi++]="02.03.21 20:50:00|0;0;34'
+        ftp = FakeFtp(self._old + new_line + partial_line)
+
+        data, state = fetch_new_data(ftp, "/days_hist.js", entry, self._stat(ftp.content))
+
+        # the line still being written is fetched again from the last newline
+        self.assertEqual(data, new_line)
+        self.assertEqual(state["offset"], len(self._old + new_line))
+
+        rest = b'787;0;21"\n'
+        ftp = FakeFtp(ftp.content + rest)
+        entry = dict(state, size=len(self._old + new_line + partial_line))
+        data, state = fetch_new_data(ftp, "/days_hist.js", entry, self._stat(ftp.content))
+        self.assertEqual(data, partial_line + rest)
+        self.assertEqual(state["offset"], len(ftp.content))
+
+    def test_prepended_without_last_newline(self):
+        content = self._old.rstrip(b"\n")
+        _, state = fetch_new_data(FakeFtp(content), "/min_day.js", None, self._stat(content))
+        self.assertEqual(state["offset"], content.rfind(b"\n") + 1)
+        new_lines = b'm[mi++]="02.03.21 21:55:00|0;0;34787;0;21"\n'
+        ftp = FakeFtp(new_lines + content)
+
+        entry = dict(state, size=len(content))
+        data, state = fetch_new_data(ftp, "/min_day.js", entry, self._stat(ftp.content))
+
+        self.assertEqual(data, new_lines)
+        self.assertEqual(state["offset"], len(ftp.content) - len(content) + content.rfind(b"\n") + 1)
+
+    def test_rewritten(self):
+        _, entry = fetch_new_data(FakeFtp(self._old), "/min_day.js", None, self._stat(self._old))
+        content = self._old.replace(b"34787", b"34788") + b"\n"
+        ftp = FakeFtp(content)
+
+        data, _ = fetch_new_data(ftp, "/min_day.js", entry, self._stat(content))
+
+        self.assertEqual(data, content)
+
+
+class TestFetchInOrder(TestCase):
+    def test_order_is_preserved(self):
+        pool = FtpConnectionPool("localhost", None, None, 2, connections=[FakeFtp(b"a"), FakeFtp(b"b")])
+        used = set()
+
+        def fetch(ftp, job):
+            used.add(id(ftp))
+            time.sleep(0.001 * (10 - job))
+            return job * 2
+
+        results = list(fetch_in_order(pool, range(10), fetch))
+
+        self.assertEqual(results, [(job, job * 2) for job in range(10)])
+        self.assertEqual(len(used), 2)
+
+
+class TestFtpSession(TestCase):
+    @patch("solarlog_exporter.ftp_sync.FTP")
+    def test_connection_is_kept(self, ftp_class):
+        session = FtpSession("localhost", "user", "secret")
+
+        self.assertEqual(session.run(lambda ftp: 1), 1)
+        self.assertEqual(session.run(lambda ftp: 2), 2)
+        session.close()
+
+        ftp_class.assert_called_once_with("localhost")
+        ftp_class.return_value.login.assert_called_once_with(user="user", passwd="secret")
+        ftp_class.return_value.quit.assert_called_once()
+
+    @patch("solarlog_exporter.ftp_sync.FTP")
+    def test_broken_connection_is_replaced_once(self, ftp_class):
+        session = FtpSession("localhost", None, None)
+        session.run(lambda ftp: None)
+        calls = []
+
+        def action(ftp):
+            calls.append(ftp)
+            if len(calls) == 1:
+                raise EOFError()
+            return "mdtm"
+
+        self.assertEqual(session.run(action), "mdtm")
+        self.assertEqual(ftp_class.call_count, 2)
+
+        def failing(ftp):
+            raise EOFError()
+
+        with self.assertRaises(EOFError):
+            session.run(failing)
+        # the idle connection and one new connection were tried
+        self.assertEqual(ftp_class.call_count, 3)
@@ -0,0 +1,173 @@
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from influxdb_client import WritePrecision
+
+from solarlog_exporter.influx import BatchWriter, InfluxConnection
+from solarlog_exporter.instrumentation import INFLUX_BATCH_LINES, INFLUX_FAILED_WRITES, INFLUX_WRITE_SECONDS
+from solarlog_exporter.spool import Spool
+
+
+class TestInfluxConnection(TestCase):
+    @patch("solarlog_exporter.influx.InfluxDBClient")
+    def test_client_is_reused(self, client_class):
+        influx = InfluxConnection("http://localhost", "8086", "org", "bucket", "token")
+
+        influx.write_lines(["a 1"])
+        influx.write_lines(["b 2"])
+        self.assertIs(influx.query_api(), influx.query_api())
+
+        client_class.assert_called_once()
+        client = client_class.return_value
+        client.write_api.assert_called_once()
+        client.write_api.return_value.write.assert_called_with(
+            org="org", bucket="bucket", record=b"b 2", write_precision=WritePrecision.S)
+
+    @patch("solarlog_exporter.influx.InfluxDBClient")
+    def test_close_only_once(self, client_class):
+        influx = InfluxConnection("http://localhost", "8086", "org", "bucket", "token")
+
+        influx.close()
+        influx.close()
+
+        client_class.return_value.close.assert_called_once()
+
+
+class FakeInflux:
+    def __init__(self, failures=0):
+        self.batches = []
+        self._failures = failures
+
+    def write_lines(self, lines):
+        if self._failures > 0:
+            self._failures -= 1
+            raise ConnectionError("influxdb not reachable")
+        self.batches.append(list(lines))
+
+
+class TestBatchWriter(TestCase):
+    def test_batches_are_split(self):
+        influx = FakeInflux()
+        writer = BatchWriter(influx, batch_size=3, flush_interval=60, queue_size=2, max_retries=0)
+
+        writer.write(["a 1", "b 2"])
+        writer.write(["c 3", "d 4"])
+        writer.flush()
+        writer.close()
+
+        self.assertEqual(influx.batches, [["a 1", "b 2", "c 3"], ["d 4"]])
+
+    def test_flush_interval(self):
+        influx = FakeInflux()
+        writer = BatchWriter(influx, batch_size=100, flush_interval=0.01, queue_size=2, max_retries=0)
+
+        writer.write(["a 1"])
+        for _ in range(100):
+            if influx.batches:
+                break
+            time.sleep(0.01)
+        writer.close()
+
+        self.assertEqual(influx.batches, [["a 1"]])
+
+    def test_retry(self):
+        influx = FakeInflux(failures=2)
+        writer = BatchWriter(influx, batch_size=10, flush_interval=60, queue_size=2,
+                             max_retries=2, retry_interval=0.001)
+
+        writer.write(["a 1"])
+        writer.close()
+
+        self.assertEqual(influx.batches, [["a 1"]])
+
+    def test_writes_are_instrumented(self):
+        influx = FakeInflux(failures=1)
+        writes = INFLUX_WRITE_SECONDS.count()
+        lines = INFLUX_BATCH_LINES.sum()
+        failed = INFLUX_FAILED_WRITES.value()
+        writer = BatchWriter(influx, batch_size=2, flush_interval=60, queue_size=2,
+                             max_retries=1, retry_interval=0.001)
+
+        writer.write(["a 1", "b 2", "c 3"])
+        writer.close()
+
+        self.assertEqual(INFLUX_WRITE_SECONDS.count() - writes, 3)
+        self.assertEqual(INFLUX_BATCH_LINES.sum() - lines, 3)
+        self.assertEqual(INFLUX_FAILED_WRITES.value() - failed, 1)
+
+    def test_error_is_raised(self):
+        influx = FakeInflux(failures=5)
+        writer = BatchWriter(influx, batch_size=10, flush_interval=60, queue_size=2,
+                             max_retries=1, retry_interval=0.001)
+
+        writer.write(["a 1"])
+        with self.assertRaises(ConnectionError):
+            writer.flush()
+        writer.close()
+
+    def test_writer_error_does_not_hang(self):
+        influx = FakeInflux()
+        writer = BatchWriter(influx, batch_size=10, flush_interval=60, queue_size=2, max_retries=0)
+
+        with patch.object(writer, "_write_batch", side_effect=RuntimeError("broken")):
+            writer.write(["a 1"])
+            with self.assertRaises(RuntimeError):
+                writer.flush()
+
+        # the thread is still running
+        writer.write(["b 2"])
+        writer.flush()
+        writer.close()
+        self.assertEqual(influx.batches, [["b 2"]])
+
+
+class TestBatchWriterSpool(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._spool = Spool(self._directory.name)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_outage_is_spooled(self):
+        influx = FakeInflux(failures=100)
+        writer = BatchWriter(influx, batch_size=10, flush_interval=60, queue_size=2,
+                             max_retries=1, retry_interval=0.001, spool=self._spool)
+
+        writer.write(["a 1"])
+        writer.flush()
+        writer.write(["b 2"])
+        writer.close()
+
+        self.assertEqual(influx.batches, [])
+        self.assertFalse(self._spool.is_empty())
+
+        # the database is back: the next writer drains the spool first
+        influx = FakeInflux()
+        writer = BatchWriter(influx, batch_size=10, flush_interval=60, queue_size=2,
+                             max_retries=0, spool=self._spool)
+        writer.write(["c 3"])
+        writer.close()
+
+        self.assertEqual(influx.batches, [["a 1"], ["b 2"], ["c 3"]])
+        self.assertTrue(self._spool.is_empty())
+
+    def test_spool_error_is_raised(self):
+        influx = FakeInflux(failures=100)
+        writer = BatchWriter(influx, batch_size=10, flush_interval=60, queue_size=2,
+                             max_retries=0, spool=self._spool)
+
+        with patch.object(self._spool, "append", side_effect=OSError("No space left on device")):
+            writer.write(["a 1"])
+            with self.assertRaises(OSError):
+                writer.flush()
+
+        with patch.object(self._spool, "sync", side_effect=OSError("No space left on device")):
+            writer.write(["b 2"])
+            with self.assertRaises(OSError):
+                writer.flush()
+            with self.assertRaises(OSError):
+                writer.close()
+        self.assertFalse(writer._thread.is_alive())
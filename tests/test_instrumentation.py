@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+from solarlog_exporter import instrumentation
+from solarlog_exporter.instrumentation import Counter, Histogram, count_points, cycle_summary, sample
+
+
+class TestCounter(TestCase):
+    def test_inc_and_render(self):
+        counter = Counter("test_lines_total", "Lines", ("file_type",))
+
+        counter.inc(3, file_type="min")
+        counter.inc(file_type="min")
+        counter.inc(2, file_type="day")
+
+        self.assertEqual(counter.value(file_type="min"), 4)
+        self.assertEqual(counter.value(), 6)
+        lines = []
+        counter.render(lines)
+        self.assertEqual(lines, [
+            "# HELP test_lines_total Lines",
+            "# TYPE test_lines_total counter",
+            'test_lines_total{file_type="day"} 2',
+            'test_lines_total{file_type="min"} 4',
+        ])
+
+
+    def test_escape_labels(self):
+        counter = Counter("test_files_total", "Files", ("file",))
+
+        counter.inc(file='min "1"\\')
+
+        lines = []
+        counter.render(lines)
+        self.assertEqual(lines[2], 'test_files_total{file="min \\"1\\"\\\\"} 1')
+
+
+class TestHistogram(TestCase):
+    def test_observe_and_render(self):
+        histogram = Histogram("test_seconds", "Seconds", buckets=(1, 5))
+
+        histogram.observe(0.5)
+        histogram.observe(2)
+        histogram.observe(10)
+
+        self.assertEqual(histogram.count(), 3)
+        self.assertEqual(histogram.sum(), 12.5)
+        lines = []
+        histogram.render(lines)
+        self.assertEqual(lines[2:], [
+            'test_seconds_bucket{le="1"} 1',
+            'test_seconds_bucket{le="5"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            "test_seconds_sum 12.5",
+            "test_seconds_count 3",
+        ])
+
+    def test_time(self):
+        histogram = Histogram("test_request_seconds", "Seconds", ("command",))
+
+        with histogram.time(command="RETR"):
+            pass
+
+        self.assertEqual(histogram.count(command="RETR"), 1)
+        self.assertEqual(histogram.count(command="MLSD"), 0)
+
+
+class TestCycle(TestCase):
+    def test_count_points(self):
+        before = sample()
+
+        points = list(count_points(iter(range(5))))
+
+        self.assertEqual(points, [0, 1, 2, 3, 4])
+        self.assertEqual(sample()["datapoints"] - before["datapoints"], 5)
+
+    def test_cycle_summary(self):
+        before = sample()
+        instrumentation.LINES.inc(7, file_type="min", result="new")
+        instrumentation.LINES.inc(2, file_type="day", result="skipped")
+        instrumentation.FTP_RECEIVED_BYTES.inc(1024, command="RETR")
+
+        summary = cycle_summary(before)
+
+        self.assertIn("(1024 bytes)", summary)
+        self.assertIn("7 lines read, 2 skipped", summary)
+
+    def test_render(self):
+        text = instrumentation.render()
+
+        for instrument in instrumentation.INSTRUMENTS:
+            self.assertIn(f"# HELP {instrument.name} ", text)
@@ -0,0 +1,55 @@
+from datetime import datetime
+from unittest import TestCase
+
+from influxdb_client import Point, WritePrecision
+
+from solarlog_exporter.line_protocol import LineFormat, format_tags, to_bytes
+from solarlog_exporter.parser import ColumnarDataParser, ConfigParser, DataParser
+from tests.test_parser import TEST_DIR
+
+
+class TestLineProtocol(TestCase):
+    def test_format_tags(self):
+        self.assertEqual(
+            format_tags("solarlog_min", {"system": "PV Anlage", "inverter": "WR 01", "group": "a,b=c"}),
+            r"solarlog_min,group=a\,b\=c,inverter=WR\ 01,system=PV\ Anlage"
+        )
+
+    def test_format_line(self):
+        line_format = LineFormat(("temperature", "Pac", "Eday", "Udc"))
+
+        self.assertEqual(
+            line_format.format("solarlog_min", (21, 1200.0, 0.5, float("nan")), 1461966900),
+            "solarlog_min Eday=0.5,Pac=1200,temperature=21i 1461966900"
+        )
+        self.assertEqual(
+            list(line_format.format_rows("solarlog_min", [1, 2], ([21, 22], [1.0, 2.5], [0.0, 0.5], [3.0, 4.0]))),
+            ["solarlog_min Eday=0,Pac=1,Udc=3,temperature=21i 1", "solarlog_min Eday=0.5,Pac=2.5,Udc=4,temperature=22i 2"]
+        )
+
+    def test_to_bytes(self):
+        self.assertEqual(to_bytes(["a 1", "b 2"]), b"a 1\nb 2")
+
+
+class TestDataParserLineProtocol(TestCase):
+    def setUp(self):
+        self._assets = TEST_DIR + "/pdc_test/"
+        self._last_record_time = datetime.strptime("01.03.2021", "%d.%m.%Y")
+
+    def _parse(self, parser_class):
+        config_parser = ConfigParser()
+        config_parser.parse_file(self._assets + "base_vars.js")
+        data_parser = parser_class(config_parser.get_inverters(), self._last_record_time)
+        data_parser.parse_file(self._assets + "days_hist.js")
+        data_parser.parse_file(self._assets + "min230721.js")
+        return data_parser
+
+    def test_same_as_influxdb_client(self):
+        data_parser = self._parse(DataParser)
+        expected = [
+            Point.from_dict(datapoint, write_precision=WritePrecision.S).to_line_protocol()
+            for datapoint in data_parser.get_datapoints_to_influx()
+        ]
+
+        self.assertEqual(data_parser.get_line_protocol(), expected)
+        self.assertEqual(self._parse(ColumnarDataParser).get_line_protocol(), expected)
@@ -0,0 +1,120 @@
+import os
+import urllib.error
+import urllib.request
+from datetime import datetime
+from unittest import TestCase
+
+from solarlog_exporter.metrics import MetricsServer, SnapshotSink
+from solarlog_exporter.parser import ColumnarDataParser, ConfigParser, DataParser
+from solarlog_exporter.sinks import MemorySink, ObservedSink
+from solarlog_exporter.utils import Point
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TAGS = {"inverter": "WR 1", "system": "PV", "group": "Haus"}
+STRING_TAGS = dict(TAGS, string="String 1")
+
+
+class TestSnapshotSink(TestCase):
+    def test_keeps_newest_sample(self):
+        snapshot = SnapshotSink()
+        snapshot.write([
+            Point("solarlog_min", TAGS, ("Pac", "Eday", "temperature"), (200, 1000, 30), 1600000300),
+            Point("solarlog_min", TAGS, ("Pac", "Eday", "temperature"), (100, 900, 29), 1600000000),
+            Point("solarlog_min_strings", STRING_TAGS, ("Pdc", "Udc"), (210, 400), 1600000300),
+            Point("solarlog_day", TAGS, ("Eday", "PacMax"), (5000, 900), 1600000000),
+        ])
+
+        text = snapshot.render().decode("utf-8")
+
+        labels = 'group="Haus",inverter="WR 1",system="PV"'
+        self.assertIn(f"solarlog_pac_watts{{{labels}}} 200.0\n", text)
+        self.assertIn(f"solarlog_eday_watthours{{{labels}}} 1000.0\n", text)
+        self.assertIn(f"solarlog_temperature_celsius{{{labels}}} 30.0\n", text)
+        string_labels = 'group="Haus",inverter="WR 1",string="String 1",system="PV"'
+        self.assertIn(f"solarlog_string_pdc_watts{{{string_labels}}} 210.0\n", text)
+        self.assertIn(f"solarlog_string_udc_volts{{{string_labels}}} 400.0\n", text)
+        self.assertIn(f"solarlog_sample_timestamp_seconds{{{labels}}} 1600000300\n", text)
+        self.assertIn("# TYPE solarlog_pac_watts gauge\n", text)
+        self.assertNotIn("PacMax", text)
+
+    def test_render_is_cached_until_update(self):
+        snapshot = SnapshotSink()
+        snapshot.write([Point("solarlog_min", TAGS, ("Pac", "Eday", "temperature"), (1, 1, 1), 100)])
+        first = snapshot.render()
+        self.assertIs(snapshot.render(), first)
+
+        # an older sample does not change the snapshot
+        snapshot.write([Point("solarlog_min", TAGS, ("Pac", "Eday", "temperature"), (2, 2, 2), 50)])
+        self.assertIs(snapshot.render(), first)
+
+        snapshot.write([Point("solarlog_min", TAGS, ("Pac", "Eday", "temperature"), (3, 3, 3), 200)])
+        self.assertIn(b"solarlog_pac_watts", snapshot.render())
+        self.assertIn(b"} 3.0\n", snapshot.render())
+
+    def test_escape_labels(self):
+        snapshot = SnapshotSink()
+        snapshot.write([Point("solarlog_min", {"inverter": 'WR "1"\\'}, ("Pac",), (1,), 100)])
+
+        self.assertIn(b'solarlog_pac_watts{inverter="WR \\"1\\"\\\\"} 1.0\n', snapshot.render())
+
+    def test_one_sample_per_inverter(self):
+        config_parser = ConfigParser()
+        config_parser.parse_file(TEST_DIR + "/pdc_test/base_vars.js")
+        inverters = config_parser.get_inverters()
+        data_parser = DataParser(inverters, datetime.strptime("01.03.2021", "%d.%m.%Y"))
+        data_parser.parse_file(TEST_DIR + "/pdc_test/min230721.js")
+        snapshot = SnapshotSink()
+        memory = MemorySink()
+
+        ObservedSink(memory, snapshot).write(data_parser.drain_points())
+
+        text = snapshot.render().decode("utf-8")
+        pac_lines = [line for line in text.splitlines() if line.startswith("solarlog_pac_watts{")]
+        self.assertEqual(len(pac_lines), inverters.get_number_of_inverters())
+        self.assertTrue(memory.points)
+        newest = max(point.epoch for point in memory.points if point.measurement == "solarlog_min")
+        self.assertIn(f"}} {newest}\n", text)
+
+
+    def test_batches(self):
+        snapshots = []
+        for batches in (False, True):
+            config_parser = ConfigParser()
+            config_parser.parse_file(TEST_DIR + "/pdc_test/base_vars.js")
+            data_parser = ColumnarDataParser(config_parser.get_inverters(),
+                                             datetime.strptime("01.03.2021", "%d.%m.%Y"))
+            data_parser.parse_file(TEST_DIR + "/pdc_test/min230721.js")
+            snapshot = SnapshotSink()
+            sink = ObservedSink(MemorySink(), snapshot)
+            if batches:
+                sink.write_batches(data_parser.drain_batches())
+            else:
+                sink.write(data_parser.drain_points())
+            self.assertTrue(sink.sink.points)
+            snapshots.append(snapshot.render())
+
+        self.assertEqual(snapshots[1], snapshots[0])
+
+
+class TestMetricsServer(TestCase):
+    def setUp(self):
+        self.snapshot = SnapshotSink()
+        self.snapshot.write([Point("solarlog_min", TAGS, ("Pac", "Eday", "temperature"), (5, 6, 7), 100)])
+        self.server = MetricsServer(self.snapshot, "127.0.0.1", 0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_scrape(self):
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.server.port}/metrics") as response:
+            self.assertEqual(response.status, 200)
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            body = response.read()
+        self.assertTrue(body.startswith(self.snapshot.render()))
+        self.assertIn(b"# TYPE solarlog_exporter_ftp_request_seconds histogram\n", body)
+
+    def test_unknown_path(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(f"http://127.0.0.1:{self.server.port}/")
+        self.assertEqual(context.exception.code, 404)
@@ -1,14 +1,36 @@
+import os
+import tempfile
+from array import array
 from datetime import datetime
 from pathlib import Path
 from unittest import TestCase
 
+import pytz
+
 from solarlog_exporter import settings
-from solarlog_exporter.parser import ConfigParser, DataParser
-from solarlog_exporter.utils import InverterList
+from solarlog_exporter.instrumentation import FTP_RECEIVED_BYTES, FTP_REQUEST_SECONDS
+from solarlog_exporter.parser import (ColumnarDataParser, ConfigCache, ConfigParser, DataParser, EndOfNewData,
+                                      LineStream, RecordCutoff)
+from solarlog_exporter.line_protocol import batches_to_line_protocol, to_line_protocol
+from solarlog_exporter.timestamps import parse_min_time
+from solarlog_exporter.utils import FileType, InverterColumns, InverterList
+from tests.fake_ftp import FakeFtp
 
 TEST_DIR = str(Path(__file__).parent)
 
 
+def assert_same_output(test_case, parse, variants, inputs):
+    """
+    Asserts that parse(variant, input) of every variant equals the one of the first variant,
+    one subTest per input of the inputs dict (name -> input)
+    """
+    for name, data in inputs.items():
+        with test_case.subTest(input=name):
+            expected = parse(variants[0], data)
+            for variant in variants[1:]:
+                test_case.assertEqual(parse(variant, data), expected)
+
+
 class TestConfigParser(TestCase):
     def setUp(self):
         self._assets = TEST_DIR + "/assets/"
@@ -67,24 +89,351 @@ class TestDataParser(TestCase):
         self._inverter_list = config_parser.get_inverters()
         self._last_record_time = datetime.strptime("01.03.2021", "%d.%m.%Y")
 
+    @staticmethod
+    def _epoch(min_time):
+        return parse_min_time(min_time).epoch
+
     def test_parse_file_in_timezone(self):
         data_parser = DataParser(self._inverter_list, self._last_record_time)
         data_parser.parse_file(self._assets + "minTEST.js")
 
-        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get('01.03.21 23:55:00').pac, 10)
-        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get('01.03.21 23:55:00').pdc, 20)
-        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get('01.03.21 23:55:00').eday, 50214)
-        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get('01.03.21 23:55:00').udc, 30)
-        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get('01.03.21 23:55:00').temperature, 21)
+        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get(self._epoch('01.03.21 23:55:00')).pac, 10)
+        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get(self._epoch('01.03.21 23:55:00')).pdc, 20)
+        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get(self._epoch('01.03.21 23:55:00')).eday, 50214)
+        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get(self._epoch('01.03.21 23:55:00')).udc, 30)
+        self.assertEqual(self._inverter_list.get_inverter(0).datapoints_min.get(self._epoch('01.03.21 23:55:00')).temperature, 21)
 
-        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get('01.03.21 23:55:00').pac, 13)
-        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get('01.03.21 23:55:00').pdc, 21)
-        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get('01.03.21 23:55:00').eday, 50858)
-        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get('01.03.21 23:55:00').udc, 32)
-        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get('01.03.21 23:55:00').temperature, 22)
+        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get(self._epoch('01.03.21 23:55:00')).pac, 13)
+        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get(self._epoch('01.03.21 23:55:00')).pdc, 21)
+        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get(self._epoch('01.03.21 23:55:00')).eday, 50858)
+        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get(self._epoch('01.03.21 23:55:00')).udc, 32)
+        self.assertEqual(self._inverter_list.get_inverter(1).datapoints_min.get(self._epoch('01.03.21 23:55:00')).temperature, 22)
 
     def test_parse_file_not_in_timezone(self):
         data_parser = DataParser(self._inverter_list, self._last_record_time)
         data_parser.parse_file(self._assets + "minTEST.js")
 
-        self.assertIsNone(self._inverter_list.get_inverter(0).datapoints_min.get('28.02.21 23:55:00'))
+        self.assertIsNone(self._inverter_list.get_inverter(0).datapoints_min.get(self._epoch('28.02.21 23:55:00')))
+
+
+class TestColumnarDataParser(TestCase):
+    def setUp(self):
+        self._assets = TEST_DIR + "/pdc_test/"
+        self._last_record_time = datetime.strptime("01.03.2021", "%d.%m.%Y")
+
+    def _parse(self, parser_class, file_names):
+        config_parser = ConfigParser()
+        config_parser.parse_file(self._assets + "base_vars.js")
+        data_parser = parser_class(config_parser.get_inverters(), self._last_record_time)
+        for file_name in file_names:
+            data_parser.parse_file(self._assets + file_name)
+        return data_parser.get_datapoints_to_influx()
+
+    def test_same_output_as_data_parser(self):
+        assert_same_output(self, self._parse, (DataParser, ColumnarDataParser), {
+            "days": ("days_hist.js",),
+            "min": ("min230721.js",),
+            "days and min": ("days_hist.js", "min230721.js"),
+        })
+
+    def test_drain_points(self):
+        config_parser = ConfigParser()
+        config_parser.parse_file(self._assets + "base_vars.js")
+        for parser_class in (DataParser, ColumnarDataParser):
+            data_parser = parser_class(config_parser.get_inverters(), self._last_record_time)
+            data_parser.parse_file(self._assets + "min230721.js")
+            expected = data_parser.get_line_protocol()
+
+            self.assertEqual(list(to_line_protocol(data_parser.drain_points())), expected)
+            # everything read is forgotten
+            self.assertEqual(data_parser.get_line_protocol(), [])
+
+    def test_drain_batches(self):
+        config_parser = ConfigParser()
+        config_parser.parse_file(self._assets + "base_vars.js")
+        expected_parser = DataParser(config_parser.get_inverters(), self._last_record_time)
+        expected_parser.parse_file(self._assets + "min230721.js")
+        data_parser = ColumnarDataParser(config_parser.get_inverters(), self._last_record_time)
+        data_parser.parse_file(self._assets + "min230721.js")
+
+        batches = list(data_parser.drain_batches())
+
+        self.assertEqual(list(batches_to_line_protocol(batches)), expected_parser.get_line_protocol())
+        # the columns are handed out as they are, not copied row by row
+        self.assertIsInstance(batches[0].columns[0], array)
+        self.assertEqual(data_parser.get_line_protocol(), [])
+
+    def test_select_rows(self):
+        time_column = ["28.02.21 23:55:00", "01.03.21 00:05:00", "01.03.21 00:10:00", "01.03.21 00:05:00"]
+
+        epochs, rows = InverterColumns._select_rows(time_column, self._last_record_time)
+
+        # the day before the last record is dropped, the later of two rows with the same time wins
+        self.assertEqual(rows, [3, 2])
+        self.assertEqual(list(epochs), [parse_min_time("01.03.21 00:05:00").epoch,
+                                        parse_min_time("01.03.21 00:10:00").epoch])
+        self.assertIsNone(InverterColumns._select_rows(time_column[1:3], self._last_record_time)[1])
+
+
+class TestRecordParser(TestCase):
+    def setUp(self):
+        self._config_parser = ConfigParser()
+        self._config_parser.parse_file(TEST_DIR + "/assets/base_vars.js")
+        self._inverters = self._config_parser.get_inverters()
+        self._last_record_time = datetime.strptime("01.03.2016", "%d.%m.%Y")
+
+    def test_same_as_parse_bytes(self):
+        for parser_class in (DataParser, ColumnarDataParser):
+            for file_name in ("min160429.js", "min_day.js", "days_hist.js"):
+                with self.subTest(parser_class=parser_class.__name__, file_name=file_name):
+                    # every parser gets its own inverters, DataParser keeps the datapoints in them
+                    data_parser = parser_class(self._config_parser.get_inverters(), self._last_record_time)
+                    data_parser.parse_file(TEST_DIR + "/assets/" + file_name)
+                    expected_parser = parser_class(self._config_parser.get_inverters(), self._last_record_time)
+                    with open(TEST_DIR + "/assets/" + file_name, "rb") as file:
+                        expected_parser.parse_bytes(file.read(), 'ISO-8859-1')
+
+                    expected = expected_parser.get_line_protocol()
+                    self.assertTrue(expected)
+                    self.assertEqual(data_parser.get_line_protocol(), expected)
+
+    def test_empty_and_other_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            data_parser = DataParser(self._inverters, self._last_record_time)
+            empty_path = Path(directory, "min160429.js")
+            empty_path.touch()
+            data_parser.parse_file(empty_path.as_posix())
+
+            file_path = Path(directory, "min160430.js")
+            file_path.write_bytes(b'var m=new Array();\r\nm[mi++]="30.04.16 12:00:00|100;50;6000;300;30|0;0;0;0;0"\r\n')
+            data_parser.parse_file(file_path.as_posix())
+
+        self.assertEqual(len(self._inverters.get_inverter(0).datapoints_min), 1)
+
+
+class TestLineStream(TestCase):
+    def test_lines_split_over_blocks(self):
+        lines = []
+        stream = LineStream(lines.append)
+
+        stream(b'm[mi++]="01.03.21 23:55:00|10;20;5')
+        stream(b'0214;30;21"\r\nm[mi++]="28.02.21 23:55:00|10;2')
+        stream(b'0;50214;30;21"')
+        stream.close()
+
+        self.assertEqual(lines, ['m[mi++]="01.03.21 23:55:00|10;20;50214;30;21"',
+                                 'm[mi++]="28.02.21 23:55:00|10;20;50214;30;21"'])
+
+    def test_same_as_parse_file(self):
+        config_parser = ConfigParser()
+        config_parser.parse_file(TEST_DIR + "/assets/base_vars.js")
+        last_record_time = datetime.strptime("01.03.2021", "%d.%m.%Y")
+        expected_parser = DataParser(config_parser.get_inverters(), last_record_time)
+        expected_parser.parse_file(TEST_DIR + "/assets/min_day.js")
+        data_parser = DataParser(config_parser.get_inverters(), last_record_time)
+
+        stream = data_parser.line_stream()
+        with open(TEST_DIR + "/assets/min_day.js", "rb") as file:
+            for block in iter(lambda: file.read(100), b""):
+                stream(block)
+        stream.close()
+
+        self.assertEqual(data_parser.get_line_protocol(), expected_parser.get_line_protocol())
+
+
+class TestConfigReader(TestCase):
+    def _parse(self, parse_line, lines):
+        config_parser = ConfigParser()
+        for line in lines:
+            parse_line(config_parser, line)
+        return config_parser._config
+
+    def _assert_same_as_pyjsparser(self, inputs):
+        assert_same_output(self, self._parse, (ConfigParser._parse_line_with_pyjsparser, ConfigParser._parse_line),
+                           inputs)
+
+    def test_same_config_as_pyjsparser(self):
+        inputs = {}
+        for file_path in (TEST_DIR + "/assets/base_vars.js", TEST_DIR + "/pdc_test/base_vars.js"):
+            with open(file_path, "r", encoding="ISO-8859-1") as file:
+                inputs[file_path] = file.readlines()
+        self._assert_same_as_pyjsparser(inputs)
+
+    def test_statements(self):
+        self._assert_same_as_pyjsparser({"statements": [
+            'var x = -1',
+            'var y = z;',
+            'X[0] = -2',
+            'var s = "a\\"b\\u00e4\\n"',
+            "var t='it\\'s'",
+            'var n = 1.5e3',
+            'var e = new Array()',
+            'q[0]=new Array("a,b",1,-1,null,true)',
+            'var a=1, b=2',
+            'AnlagenGrp[0]=new Array("Gruppe 1")',
+            'AnlagenGrp[0][1][0]=1',
+            'AnlagenGrp[0][1][1]=new Array(2,3)',
+            'WRInfo[0]=new Array("PAC7","100001",7800)',
+            'WRInfo[0][6]="group"',
+            'WRInfo[0][16]=1',
+            '// comment',
+            '',
+        ]})
+
+
+class TestConfigCache(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._cache_file = os.path.join(self._directory.name, "config_cache.json")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_ftp_file_only_downloaded_when_changed(self):
+        ftp = FakeFtp(Path(TEST_DIR, "pdc_test", "base_vars.js").read_bytes())
+        config_cache = ConfigCache(self._cache_file)
+
+        config_parser = config_cache.get_ftp_file(ftp, "/base_vars.js", (1, "20230722041513"))
+        config_cache.get_ftp_file(ftp, "/base_vars.js", (1, "20230722041513"))
+        self.assertEqual(ftp.downloads, 1)
+        self.assertEqual(config_parser.get_inverters().get_number_of_inverters(), 11)
+
+        config_cache.get_ftp_file(ftp, "/base_vars.js", (1, "20230723041513"))
+        self.assertEqual(ftp.downloads, 2)
+
+    def test_ftp_file_is_instrumented(self):
+        ftp = FakeFtp(Path(TEST_DIR, "pdc_test", "base_vars.js").read_bytes())
+        transfers = FTP_REQUEST_SECONDS.count(command="RETR")
+        received = FTP_RECEIVED_BYTES.value(command="RETR")
+
+        ConfigCache(self._cache_file).get_ftp_file(ftp, "/base_vars.js", (1, "20230722041513"))
+
+        self.assertEqual(FTP_REQUEST_SECONDS.count(command="RETR"), transfers + 1)
+        self.assertEqual(FTP_RECEIVED_BYTES.value(command="RETR"), received + len(ftp.content))
+
+    def test_stored_on_disk(self):
+        ftp = FakeFtp(Path(TEST_DIR, "pdc_test", "base_vars.js").read_bytes())
+        ConfigCache(self._cache_file).get_ftp_file(ftp, "/base_vars.js", (1, "20230722041513"))
+
+        config_parser = ConfigCache(self._cache_file).get_ftp_file(ftp, "/base_vars.js", (1, "20230722041513"))
+
+        self.assertEqual(ftp.downloads, 1)
+        self.assertEqual(config_parser.get_inverters().get_number_of_inverters(), 11)
+
+    def test_local_file(self):
+        config_cache = ConfigCache()
+        config_parser = config_cache.get_file(TEST_DIR + "/assets/base_vars.js")
+
+        self.assertIs(config_cache.get_file(TEST_DIR + "/assets/base_vars.js")._config, config_parser._config)
+        self.assertEqual(config_parser.get_power(), "100 kwp")
+
+
+class TestRecordCutoff(TestCase):
+    def setUp(self):
+        config_parser = ConfigParser()
+        config_parser.parse_file(TEST_DIR + "/assets/base_vars.js")
+        self._inverter_list = config_parser.get_inverters()
+
+    def test_only_newer_samples(self):
+        last_record_time = datetime.strptime("02.03.2021 21:40:00", "%d.%m.%Y %H:%M:%S")
+        data_parser = DataParser(self._inverter_list, last_record_time, early_exit=False)
+        data_parser.parse_file(TEST_DIR + "/assets/min_day.js")
+
+        epochs = sorted(self._inverter_list.get_inverter(0).datapoints_min)
+        self.assertEqual(epochs[0], parse_min_time("02.03.21 21:45:00").epoch)
+        self.assertEqual(len(epochs), 4)
+        self.assertEqual(data_parser.cutoff.skipped, 75)
+        self.assertEqual(data_parser.cutoff.skipped_lines, {FileType.MIN: 75, FileType.DAY: 0})
+        self.assertEqual(data_parser.cutoff.lines[FileType.MIN], 79)
+        self.assertEqual(data_parser.cutoff.newest, "02.03.21 22:00:00")
+        self.assertEqual(data_parser.cutoff.get_newest_time(), parse_min_time("02.03.21 22:00:00").date_time)
+
+    def test_day_of_last_record_is_kept(self):
+        last_record_time = pytz.utc.localize(datetime(2021, 3, 1, 12, 0))
+        data_parser = ColumnarDataParser(self._inverter_list, last_record_time)
+        data_parser.parse_file(TEST_DIR + "/assets/days_hist.js")
+
+        # 01.03., 02.03. and 29.04. for both inverters
+        self.assertEqual(len(data_parser.get_datapoints_to_influx()), 6)
+        self.assertEqual(data_parser.cutoff.skipped, 4)
+
+    def test_line_compare(self):
+        cutoff = RecordCutoff(datetime(2021, 3, 2, 21, 40))
+
+        self.assertTrue(cutoff.is_new(FileType.MIN, 'm[mi++]="02.03.21 21:45:00|0;0;34787;0;21"'))
+        self.assertFalse(cutoff.is_new(FileType.MIN, 'm[mi++]="02.03.21 21:40:00|0;0;34787;0;21"'))
+        self.assertFalse(cutoff.is_new(FileType.MIN, 'm[mi++]="31.12.20 23:55:00|0;0;34787;0;21"'))
+        self.assertTrue(cutoff.is_new(FileType.DAY, 'da[dx++]="02.03.21|34787;0"'))
+        self.assertFalse(cutoff.is_new(FileType.DAY, 'da[dx++]="01.03.21|34787;0"'))
+        self.assertEqual(cutoff.skipped, 3)
+
+    def test_merge(self):
+        cutoff = RecordCutoff(datetime(2021, 3, 2, 21, 40), early_exit=True)
+        cutoff.is_new(FileType.MIN, 'm[mi++]="02.03.21 21:45:00|0;0;34787;0;21"')
+        other = RecordCutoff(datetime(2021, 3, 2, 21, 40))
+        other.is_new(FileType.MIN, 'm[mi++]="02.03.21 21:50:00|0;0;34787;0;21"')
+        other.is_new(FileType.DAY, 'da[dx++]="01.03.21|34787;0"')
+
+        cutoff.merge(other)
+
+        self.assertEqual(cutoff.lines, {FileType.MIN: 2, FileType.DAY: 1})
+        self.assertEqual(cutoff.skipped_lines, {FileType.MIN: 0, FileType.DAY: 1})
+        self.assertEqual(cutoff.newest, "02.03.21 21:50:00")
+        self.assertFalse(cutoff.early_exit)
+
+    def test_early_exit(self):
+        last_record_time = datetime.strptime("02.03.2021 21:40:00", "%d.%m.%Y %H:%M:%S")
+        data_parser = DataParser(self._inverter_list, last_record_time, early_exit=True)
+        data_parser.parse_file(TEST_DIR + "/assets/min_day.js")
+
+        self.assertEqual(len(self._inverter_list.get_inverter(0).datapoints_min), 4)
+        # reading stopped at the first old line
+        self.assertEqual(data_parser.cutoff.skipped, 1)
+
+    def test_early_exit_stream(self):
+        last_record_time = datetime.strptime("02.03.2021 21:40:00", "%d.%m.%Y %H:%M:%S")
+        data_parser = DataParser(self._inverter_list, last_record_time, early_exit=True)
+        stream = data_parser.line_stream()
+        with open(TEST_DIR + "/assets/min_day.js", "rb") as file:
+            with self.assertRaises(EndOfNewData):
+                while True:
+                    stream(file.read(100))
+        stream.close()
+
+        self.assertTrue(stream.stopped)
+        self.assertEqual(len(self._inverter_list.get_inverter(0).datapoints_min), 4)
+
+    def test_early_exit_keeps_appended_day_rows(self):
+        # days_hist.js has 02.03. and 29.04. appended after older days
+        last_record_time = pytz.utc.localize(datetime(2021, 3, 1, 12, 0))
+        for parser_class in (DataParser, ColumnarDataParser):
+            with self.subTest(parser_class=parser_class.__name__):
+                config_parser = ConfigParser()
+                config_parser.parse_file(TEST_DIR + "/assets/base_vars.js")
+                data_parser = parser_class(config_parser.get_inverters(), last_record_time, early_exit=True)
+                data_parser.parse_file(TEST_DIR + "/assets/days_hist.js")
+
+                self.assertEqual(len(data_parser.get_datapoints_to_influx()), 6)
+                self.assertEqual(data_parser.cutoff.skipped, 4)
+
+    def test_oldest_first_file_is_read_completely(self):
+        last_record_time = datetime.strptime("02.03.2021 21:40:00", "%d.%m.%Y %H:%M:%S")
+        data_parser = DataParser(self._inverter_list, last_record_time, early_exit=True)
+        with open(TEST_DIR + "/assets/min_day.js", "rb") as file:
+            lines = file.read().splitlines()
+        # the first line is already imported, the second one shows the order before anything ends
+        data_parser.parse_bytes(b"\n".join(reversed(lines)))
+
+        self.assertEqual(len(self._inverter_list.get_inverter(0).datapoints_min), 4)
+        self.assertEqual(data_parser.cutoff.skipped, 75)
+
+    def test_unsorted_file_disables_early_exit(self):
+        last_record_time = pytz.utc.localize(datetime(2021, 3, 1, 12, 0))
+        data_parser = ColumnarDataParser(self._inverter_list, last_record_time, early_exit=True)
+        with open(TEST_DIR + "/assets/days_hist.js", "rb") as file:
+            lines = file.read().splitlines(keepends=True)
+        # 29.04. right after 02.03. shows that the lines are not sorted newest first
+        data_parser.parse_bytes(b"".join(lines[-2:] + lines[:-2]))
+
+        self.assertFalse(data_parser.cutoff.early_exit)
+        self.assertEqual(len(data_parser.get_datapoints_to_influx()), 6)
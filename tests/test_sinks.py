@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from solarlog_exporter.core import start_export
+from solarlog_exporter.parser import ConfigParser, DataParser
+from solarlog_exporter.sinks import InfluxSink, MemorySink, ParquetSink, read_parquet
+from solarlog_exporter.utils import Point
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeWriter:
+    def __init__(self):
+        self.chunks = []
+        self.flushed = False
+
+    def write(self, lines):
+        self.chunks.append(list(lines))
+
+    def flush(self):
+        self.flushed = True
+
+    def close(self):
+        self.flush()
+
+
+class TestSinks(TestCase):
+    def setUp(self):
+        config_parser = ConfigParser()
+        config_parser.parse_file(TEST_DIR + "/pdc_test/base_vars.js")
+        self._data_parser = DataParser(config_parser.get_inverters(), datetime.strptime("01.03.2021", "%d.%m.%Y"))
+        self._data_parser.parse_file(TEST_DIR + "/pdc_test/min230721.js")
+
+    def test_memory_sink(self):
+        expected = len(self._data_parser.get_line_protocol())
+        sink = MemorySink()
+
+        sink.write(self._data_parser.drain_points())
+        sink.close()
+
+        self.assertEqual(len(sink.points), expected)
+        self.assertIsInstance(sink.points[0], Point)
+
+    def test_influx_sink(self):
+        expected = self._data_parser.get_line_protocol()
+        writer = FakeWriter()
+        sink = InfluxSink(writer, chunk_size=1000)
+
+        sink.write(self._data_parser.drain_points())
+        sink.flush()
+
+        self.assertEqual(sum(writer.chunks, []), expected)
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in writer.chunks))
+        self.assertTrue(writer.flushed)
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_parquet_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = ParquetSink(directory)
+            # 2021-03-01 12:00 and 2021-03-01 23:30 (UTC) are on two local days
+            sink.write([
+                Point("solarlog_min", {"inverter": "WR 01"}, ("Pac",), (1.0,), 1614600000),
+                Point("solarlog_min", {"inverter": "WR 02"}, ("Pac", "Eday"), (2.0, 3.0), 1614600000),
+                Point("solarlog_min", {"inverter": "WR 01"}, ("Pac",), (4.0,), 1614641400),
+            ])
+            sink.close()
+
+            self.assertEqual(sorted(os.listdir(os.path.join(directory, "solarlog_min"))),
+                             ["date=2021-03-01", "date=2021-03-02"])
+            table = read_parquet(directory, "solarlog_min", days=["2021-03-01"])
+            self.assertEqual(table.column("Eday").to_pylist(), [None, 3.0])
+            self.assertEqual(table.column("inverter").to_pylist(), ["WR 01", "WR 02"])
+            self.assertTrue(pyarrow.types.is_dictionary(table.schema.field("inverter").type))
+            self.assertEqual(read_parquet(directory, "solarlog_min").num_rows, 3)
+            self.assertIsNone(read_parquet(directory, "solarlog_day"))
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_export(self):
+        expected = len(self._data_parser.get_line_protocol())
+        with tempfile.TemporaryDirectory() as directory:
+            start_export(TEST_DIR + "/pdc_test", directory)
+            # a second export replaces the files instead of adding the rows again
+            start_export(TEST_DIR + "/pdc_test", directory)
+
+            rows = sum(read_parquet(directory, measurement).num_rows
+                       for measurement in ("solarlog_min", "solarlog_min_strings"))
+            self.assertEqual(rows, expected)
+            # one day, eleven inverters
+            self.assertEqual(read_parquet(directory, "solarlog_day").num_rows, 11)
+
+    def test_export_without_pyarrow(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.dict(sys.modules, {"pyarrow": None, "pyarrow.parquet": None}):
+            with self.assertRaisesRegex(ImportError, r"pip install \.\[parquet\]"):
+                start_export(TEST_DIR + "/pdc_test", directory)
+            self.assertEqual(os.listdir(directory), [])
@@ -0,0 +1,53 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from solarlog_exporter.spool import Spool
+
+
+class TestSpool(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._spool_directory = os.path.join(self._directory.name, "spool")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_append_and_read(self):
+        spool = Spool(self._spool_directory)
+        self.assertTrue(spool.is_empty())
+
+        spool.append(["a 1", "b 2"])
+        spool.append(["c 3"])
+
+        segments = spool.segments()
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(list(Spool.read(segments[0])), [["a 1", "b 2"], ["c 3"]])
+
+        Spool.remove(segments[0])
+        self.assertTrue(spool.is_empty())
+
+    def test_segments(self):
+        spool = Spool(self._spool_directory, segment_size=1)
+
+        spool.append(["a 1"])
+        spool.append(["b 2"])
+        spool.close()
+        # appends after reading the segments start a new segment
+        segments = spool.segments()
+        spool.append(["c 3"])
+
+        self.assertEqual(len(segments), 2)
+        self.assertEqual([list(Spool.read(path)) for path in spool.segments()], [[["a 1"]], [["b 2"]], [["c 3"]]])
+
+    def test_incomplete_record(self):
+        spool = Spool(self._spool_directory)
+        spool.append(["a 1"])
+        spool.append(["b 2"])
+        path = spool.segments()[0]
+
+        # crash while the last record was written
+        with open(path, "r+b") as file:
+            file.truncate(os.path.getsize(path) - 3)
+
+        self.assertEqual(list(Spool.read(path)), [["a 1"]])
@@ -0,0 +1,49 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytz
+
+from solarlog_exporter import settings, timestamps
+from solarlog_exporter.timestamps import epoch_to_influxdb, localize_bulk, parse_day_time, parse_min_time
+
+
+class TestLocalizeBulk(TestCase):
+    def test_same_as_localize(self):
+        timezone = pytz.timezone(settings.TIMEZONE)
+        time_strings = ["29.04.16 23:55:00", "29.04.16 00:05:00", "27.03.16 01:55:00",
+                        "27.03.16 03:05:00", "30.10.16 02:30:00", "30.10.16 23:55:00", "01.03.21"]
+
+        epochs = localize_bulk(time_strings)
+
+        for time_string, epoch in zip(time_strings, epochs):
+            time_format = "%d.%m.%y %H:%M:%S" if len(time_string) > 8 else "%d.%m.%y"
+            expected = timezone.localize(datetime.strptime(time_string, time_format))
+            self.assertEqual(epoch, int(expected.timestamp()))
+            self.assertEqual(
+                epoch_to_influxdb(epoch),
+                expected.astimezone(pytz.utc).isoformat().replace("+00:00", "Z")
+            )
+
+
+class TestParseTime(TestCase):
+    def test_parse_min_time_is_cached(self):
+        self.assertIs(parse_min_time("29.04.16 23:55:00"), parse_min_time("29.04.16 23:55:00"))
+
+    def test_influxdb_time_is_built_once_when_used(self):
+        with patch.object(timestamps, "epoch_to_influxdb", wraps=epoch_to_influxdb) as to_influxdb:
+            timestamp = parse_min_time("12.06.19 08:35:00")
+            to_influxdb.assert_not_called()
+
+            self.assertEqual(timestamp.influxdb, epoch_to_influxdb(timestamp.epoch))
+            self.assertEqual(timestamp.influxdb, epoch_to_influxdb(timestamp.epoch))
+            to_influxdb.assert_called_once_with(timestamp.epoch)
+
+    def test_parse_day_time(self):
+        timezone = pytz.timezone(settings.TIMEZONE)
+        expected = timezone.localize(datetime.strptime("02.03.21", "%d.%m.%y"))
+
+        timestamp = parse_day_time("02.03.21")
+        self.assertEqual(timestamp.date_time, expected)
+        self.assertEqual(timestamp.influxdb, expected.astimezone(pytz.utc).isoformat().replace("+00:00", "Z"))
+        self.assertEqual(timestamp.epoch, int(timestamp.date_time.timestamp()))
@@ -6,7 +6,8 @@ from unittest.mock import MagicMock, patch, create_autospec
 import pytz
 
 from solarlog_exporter import settings
-from solarlog_exporter.utils import InverterList, FileType, Inverter, DayDatapoint, MinDatapoint, Datapoint
+from solarlog_exporter.timestamps import parse_day_time, parse_min_time
+from solarlog_exporter.utils import InverterList, FileType, Inverter, DayDatapoint, MinDatapoint, Datapoint, StringDatapoint
 
 
 class FileTypeTest(unittest.TestCase):
@@ -142,7 +143,7 @@ class TestInverter(TestCase):
 
         influx_points = inverter.get_datapoints_to_influx()
         self.assertNotEqual(influx_points, {})
-        self.assertNotEqual(inverter.datapoints_day[self._date_today].pac, 0.0)
+        self.assertNotEqual(inverter.datapoints_day[parse_day_time(self._date_today).epoch].pac, 0.0)
 
 
 class TestMinDatapoint(TestCase):
@@ -216,3 +217,36 @@ class TestDayDatapoint(TestCase):
     # todo: add tests
     def test_calculate_values(self):
         pass
+
+
+class TestDatapointSlots(TestCase):
+    def test_no_instance_dict(self):
+        datapoints = [
+            MinDatapoint("29.04.16 23:55:00", 1200, 4000, 60),
+            DayDatapoint("29.04.16", 1200, 300),
+            StringDatapoint("29.04.16 23:55:00", "String 1", 600, 400),
+        ]
+        for datapoint in datapoints:
+            self.assertFalse(hasattr(datapoint, "__dict__"))
+
+    def test_timestamp_is_shared(self):
+        datapoint = MinDatapoint("29.04.16 23:55:00", 1200, 4000, 60)
+        string_datapoint = StringDatapoint(datapoint.timestamp, "String 1", 600, 400)
+
+        self.assertIs(string_datapoint.timestamp, datapoint.timestamp)
+        self.assertEqual(string_datapoint.date_time, datapoint.date_time)
+
+
+class TestInverterStore(TestCase):
+    def test_keyed_by_epoch(self):
+        inverter = Inverter([["PAC7", "  10002579", 7800, 1, "WR 1", 1, None]], "testsystem")
+        last_record_time = datetime(2016, 4, 1)
+        for min_time in ("29.04.16 23:55:00", "29.04.16 23:45:00", "29.04.16 23:50:00", "29.04.16 23:55:00"):
+            inverter.add_datapoint(MinDatapoint(min_time, 1200, 4000, 60), last_record_time)
+
+        epoch = parse_min_time("29.04.16 23:50:00").epoch
+        self.assertEqual(len(inverter.datapoints_min), 3)
+        self.assertIn(epoch, inverter.datapoints_min)
+
+        datapoints = Inverter.get_datapoints_between(inverter.datapoints_min, start=epoch)
+        self.assertEqual([datapoint.timestamp.epoch for datapoint in datapoints], [epoch, epoch + 300])
@@ -0,0 +1,66 @@
+import os
+import queue
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+from solarlog_exporter.watch import AdaptivePoll, DirectoryWatcher, _ChangeHandler
+
+
+class TestAdaptivePoll(TestCase):
+    def test_interval(self):
+        poll = AdaptivePoll(10, 60)
+
+        self.assertTrue(poll.changed("20230721120000"))
+        self.assertEqual(poll.interval, 10)
+        self.assertFalse(poll.changed("20230721120000"))
+        self.assertEqual(poll.interval, 15)
+        for _ in range(10):
+            poll.changed("20230721120000")
+        self.assertEqual(poll.interval, 60)
+
+        self.assertTrue(poll.changed("20230721120500"))
+        self.assertEqual(poll.interval, 10)
+
+    def test_without_mdtm(self):
+        poll = AdaptivePoll(10, 60)
+
+        self.assertTrue(poll.changed(None))
+        self.assertEqual(poll.interval, 60)
+
+
+class TestDirectoryWatcher(TestCase):
+    def test_change_handler(self):
+        changes = queue.Queue()
+        handler = _ChangeHandler(changes)
+
+        handler.on_any_event(SimpleNamespace(is_directory=False, event_type="modified", src_path="/data/min_day.js"))
+        handler.on_any_event(SimpleNamespace(is_directory=False, event_type="moved", src_path="/data/.tmp",
+                                             dest_path="/data/min230721.js"))
+        handler.on_any_event(SimpleNamespace(is_directory=False, event_type="deleted", src_path="/data/days.js"))
+        handler.on_any_event(SimpleNamespace(is_directory=False, event_type="modified", src_path="/data/log.txt"))
+
+        self.assertEqual([changes.get_nowait(), changes.get_nowait()], ["min_day.js", "min230721.js"])
+        self.assertTrue(changes.empty())
+
+    def test_wait(self):
+        watcher = DirectoryWatcher.__new__(DirectoryWatcher)
+        watcher._changes = queue.Queue()
+        watcher._settle = 0.01
+        for name in ("min_day.js", "days.js", "min_day.js"):
+            watcher._changes.put(name)
+
+        self.assertEqual(watcher.wait(timeout=0.01), {"min_day.js", "days.js"})
+        self.assertEqual(watcher.wait(timeout=0.01), set())
+
+    def test_watch_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            watcher = DirectoryWatcher(directory, settle=0.2)
+            watcher.start()
+            try:
+                with open(os.path.join(directory, "min_day.js"), "w") as file:
+                    file.write('m[mi++]="01.03.21 23:55:00|10;20;50214;30;21"\n')
+
+                self.assertEqual(watcher.wait(timeout=5), {"min_day.js"})
+            finally:
+                watcher.stop()